@@ -0,0 +1,70 @@
+"""
+Benchmark: serializing a 10k row product list
+
+Compares the ORM path (Product instances, serialize() and jsonify) with
+the column-only path of service.serializers.
+
+Usage: python -m benchmarks.bench_serializers [rows] [repeat]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URI", "sqlite://")
+
+from flask import jsonify  # noqa: E402
+from service import app, serializers  # noqa: E402
+from service.models import Product, db  # noqa: E402
+
+
+def seed(rows):
+    """Loads the table with the given number of products"""
+    db.session.query(Product).delete()
+    products = []
+    for i in range(rows):
+        product = Product()
+        product.deserialize({"name": f"Product {i}", "description": "A product", "price": i % 1000 + 0.99,
+                             "available": i % 2 == 0, "category": "TOOLS"})
+        products.append(product)
+    Product.bulk_create(products)
+
+
+def orm_path():
+    """Serializes the way list_products did before"""
+    db.session.expire_all()
+    products = Product.query.order_by(Product.id).all()
+    return jsonify([product.serialize() for product in products]).get_data()
+
+
+def column_path():
+    """Serializes with column rows and the fast encoder"""
+    rows = serializers.project(Product.query.order_by(Product.id))
+    return serializers.dumps([serializers.serialize_row(row) for row in rows]) + b"\n"
+
+
+def best_of(function, repeat):
+    """Returns the fastest of several timed runs in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(rows=10000, repeat=5):
+    """Runs both paths and prints their throughput"""
+    with app.app_context():
+        db.create_all()
+        seed(rows)
+        assert orm_path() == column_path(), "outputs differ"
+        orm = best_of(orm_path, repeat)
+        column = best_of(column_path, repeat)
+    print(f"rows: {rows}  orjson: {serializers.orjson is not None}")
+    print(f"orm + jsonify:   {rows / orm:12,.0f} rows/s  ({orm * 1000:.1f} ms)")
+    print(f"columns + dumps: {rows / column:12,.0f} rows/s  ({column * 1000:.1f} ms)")
+    print(f"speedup:         {orm / column:12.2f}x")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,80 @@
+"""
+Gunicorn Configuration
+
+Gunicorn reads this file from the working directory on start up.
+
+Workers default to gthread: each worker process serves GUNICORN_THREADS
+requests per CPU at once, so a request waiting on the database no longer
+blocks its whole worker. Set GUNICORN_WORKER_CLASS=gevent (needs the
+gevent and psycogreen packages) to hold many more slow clients per box,
+up to GUNICORN_WORKER_CONNECTIONS each. Every count can be overridden
+from the environment.
+
+The database tables are not made on start up, run ``flask db-init``
+before starting the service.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+CPUS = multiprocessing.cpu_count()
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+# Sync workers only serve one request each, so they need more processes
+workers = int(os.getenv("GUNICORN_WORKERS", str(CPUS * 2 + 1 if worker_class == "sync" else CPUS)))
+# More than one thread turns sync workers into gthread ones
+threads = 1 if worker_class == "sync" else int(os.getenv("GUNICORN_THREADS", str(max(2, 4 * CPUS // workers))))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Import the app once in the master so workers fork from it ready to serve.
+# gevent has to patch the standard library before the app is imported, so
+# its workers load the app themselves unless GUNICORN_PRELOAD says otherwise.
+preload_app = os.getenv("GUNICORN_PRELOAD", str(not worker_class.startswith("gevent"))).lower() in ["true", "yes", "1"]
+
+# Give every thread a pooled connection so none of them waits for one
+if worker_class == "gthread":
+    os.environ.setdefault("SQLALCHEMY_POOL_SIZE", str(threads))
+
+# Workers share their Prometheus samples through this directory
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "products-metrics"))
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Empties the metrics directory so samples of a previous run are not counted"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_worker_init(worker):
+    """
+    Opens the database connections of a new worker before it takes requests
+
+    This runs after the worker loaded the app and, for gevent workers,
+    after gevent patched the standard library. psycopg2 talks to the
+    server in C, so it is made to yield to other greenlets separately
+    before any pooled connection is opened.
+    """
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+    from service.common import pool
+
+    if worker.cfg.worker_class_str.startswith("gevent"):
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()
+    app = worker.wsgi
+    with app.app_context():
+        pool.warm_up(db.engine, app.config["SQLALCHEMY_POOL_PREOPEN"])
+    if "replicas" in app.extensions:
+        for engine in app.extensions["replicas"].engines:
+            engine.dispose(close=False)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the live samples of a worker that went away"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
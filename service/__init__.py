@@ -20,39 +20,70 @@ Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
+
+Apps are made by create_app(). The default one, ``service.app``, is only
+made the first time it is asked for, so tools that import the models or
+serializers do not pay for it. The tables are not created on start up,
+run ``flask db-init`` once per deploy instead.
 """
 import sys
+from time import perf_counter
 from flask import Flask
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, profiler, slow_queries
+
+
+def create_app(config_object=None):
+    """
+    Creates and configures a Flask app
+
+    Args:
+        config_object: an object or a dict with settings that replace the
+            ones in service.config
+    """
+    started = perf_counter()
+    app = Flask(__name__)
+
+    # Load Configurations
+    app.config.from_object(config)
+    if isinstance(config_object, dict):
+        app.config.from_mapping(config_object)
+    elif config_object is not None:
+        app.config.from_object(config_object)
 
-# NOTE: Do not change the order of this code
-# The Flask app must be created
-# BEFORE you import modules that depend on it !!!
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    from service import routes, models
+    from service.common import error_handlers, cli_commands, metrics
 
-# Create the Flask aoo
-app = Flask(__name__)  # pylint: disable=invalid-name
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
 
-# Load Configurations
-app.config.from_object(config)
+    app.logger.info(70 * "*")
+    app.logger.info("  P E T   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
 
-# Dependencies require we import the routes AFTER the Flask app is created
-# pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
-from service import routes, models        # noqa: F401, E402
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+    try:
+        models.init_db(app)  # connect sqlalchemy to the app
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    app.register_blueprint(routes.api)
+    app.register_blueprint(error_handlers.errors)
+    app.register_blueprint(cli_commands.commands)
+    app.register_blueprint(metrics.hooks)
+    profiler.init_app(app)
+    slow_queries.init_app(app, models.db)
 
-app.logger.info(70 * "*")
-app.logger.info("  P E T   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    app.config["STARTUP_SECONDS"] = perf_counter() - started
+    app.logger.info("Service initialized in %.1f ms", app.config["STARTUP_SECONDS"] * 1000)
+    return app
 
-try:
-    models.init_db(app)  # make our sqlalchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service initialized!")
+def __getattr__(name):
+    """Makes the default app the first time ``service.app`` is used"""
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
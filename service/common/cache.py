@@ -0,0 +1,215 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Cache Backends
+
+This module contains small key/value caches with hit and miss counters.
+CacheBackend is the interface every backend implements, and init_app()
+picks one with PRODUCT_CACHE_BACKEND:
+
+- ``none`` (the default) caches nothing
+- ``memory`` is an LRUCache in each worker process. A write only drops
+  the entry of the process that made it, so other workers can serve the
+  old value for up to PRODUCT_CACHE_TTL seconds
+- ``redis`` is one RedisCache at PRODUCT_CACHE_URL shared by every worker,
+  so a write is seen everywhere at once
+
+Values must be JSON serializable so any backend can store them.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger("flask.app")
+
+# Errors of the redis client that are counted as cache misses
+REDIS_ERRORS = (redis.RedisError,) if redis else ()
+
+BACKENDS = ("none", "memory", "redis")
+
+
+class CacheBackend:
+    """Interface for a key/value cache that counts hits and misses"""
+
+    # False for backends that never store anything, so callers can skip them
+    enabled = True
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the value stored for key or None"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """Stores a value for key, for at most ``ttl`` seconds when given"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Removes key from the cache if it is there"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Removes every key from the cache"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns the hit and miss counters"""
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class NullCache(CacheBackend):
+    """Backend that stores nothing, used when caching is turned off"""
+
+    enabled = False
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process least recently used cache with a time to live
+
+    Entries older than ``ttl`` seconds are treated as misses and a
+    ``maxsize`` of 0 turns the cache off.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0, timer=time.monotonic):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.timer():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (self.timer() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        data = super().stats()
+        data["size"] = len(self._entries)
+        return data
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache shared by every worker process through a Redis server
+
+    Values are stored as JSON under ``prefix`` and expire after ``ttl``
+    seconds. Errors talking to Redis are logged and count as misses, so an
+    unreachable server slows requests down but does not fail them. A
+    delete that fails leaves the old value until it expires.
+    """
+
+    def __init__(self, url="redis://localhost:6379/0", ttl=60.0, prefix="products:cache:", client=None):
+        super().__init__()
+        if client is None:
+            if redis is None:
+                raise RuntimeError("The redis cache backend needs redis, install it with: pip install redis")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            data = self.client.get(f"{self.prefix}{key}")
+        except REDIS_ERRORS as error:
+            logger.warning("Cache get of %s failed: %s", key, error)
+            data = None
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(data)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        try:
+            self.client.set(f"{self.prefix}{key}", json.dumps(value), px=int(ttl * 1000))
+        except REDIS_ERRORS as error:
+            logger.warning("Cache set of %s failed: %s", key, error)
+
+    def delete(self, key):
+        try:
+            self.client.delete(f"{self.prefix}{key}")
+        except REDIS_ERRORS as error:
+            logger.warning("Cache delete of %s failed: %s", key, error)
+
+    def clear(self):
+        try:
+            keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+            if keys:
+                self.client.delete(*keys)
+        except REDIS_ERRORS as error:
+            logger.warning("Cache clear failed: %s", error)
+
+
+def init_app(app):
+    """Returns the cache backend chosen by PRODUCT_CACHE_BACKEND"""
+    backend = app.config.get("PRODUCT_CACHE_BACKEND", "none")
+    ttl = app.config.get("PRODUCT_CACHE_TTL", 60)
+    if backend == "memory":
+        return LRUCache(app.config.get("PRODUCT_CACHE_SIZE", 1024), ttl)
+    if backend == "redis":
+        return RedisCache(app.config.get("PRODUCT_CACHE_URL", "redis://localhost:6379/0"), ttl)
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"Unknown PRODUCT_CACHE_BACKEND {backend!r}, use {', '.join(BACKENDS)}")
@@ -1,15 +1,25 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
-from service.models import db
+import asyncio
+import json
+import time
+import click
+from flask import Blueprint
+from flask import current_app as app
+from service import serializers, transfer
+from service.common import loadtest, slow_queries
+from service.models import db, Product, ProductStats, Category, DataValidationError, add_missing_columns
+
+# Commands are added to the flask command itself rather than a group
+commands = Blueprint("commands", __name__, cli_group=None)
 
 
 ######################################################################
 # Command to force tables to be rebuilt
 # Usage: flask db-create
 ######################################################################
-@app.cli.command("db-create")
+@commands.cli.command("db-create")
 def db_create():
     """
     Recreates a local database. You probably should not use this on
@@ -18,3 +28,207 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to create the tables that are missing
+# Usage: flask db-init
+######################################################################
+@commands.cli.command("db-init")
+def db_init():
+    """
+    Creates the tables and indexes that do not exist yet and adds the
+    columns an older product table lacks. It keeps the data, so run it
+    on every deploy before starting the service.
+    """
+    db.create_all()
+    add_missing_columns(db.session.connection())
+    db.session.commit()
+
+
+######################################################################
+# Command to repair the category stats
+# Usage: flask products-stats-rebuild
+######################################################################
+@commands.cli.command("products-stats-rebuild")
+def products_stats_rebuild():
+    """
+    Recomputes the category stats from the products table. Use it after
+    loading data behind the service's back.
+    """
+    ProductStats.recompute(db.session.connection())
+    db.session.commit()
+
+
+######################################################################
+# Command to load products from a file
+# Usage: flask products-import products.csv
+######################################################################
+@commands.cli.command("products-import")
+@click.argument("source", type=click.File("r"))
+@click.option("--format", "fmt", type=click.Choice(transfer.FORMATS), help="Defaults to the file extension.")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows loaded per transaction.")
+@click.option("--rejects", type=click.File("w"), help="Where to write rejected records. Defaults to SOURCE.rejects.ndjson.")
+def products_import(source, fmt, batch_size, rejects):
+    """
+    Loads Products from a CSV or NDJSON file
+
+    Every record is checked like the API checks it and the ones that fail
+    are written to the reject file with their line number and error.
+    Valid rows are loaded in batches with COPY on PostgreSQL.
+    """
+    name = getattr(source, "name", "<stdin>")
+    fmt = fmt or transfer.guess_format(name)
+    if rejects is None:
+        rejects = click.open_file(f"{name}.rejects.ndjson" if name != "<stdin>" else "-", "w")
+    loaded = rejected = 0
+    started = time.monotonic()
+    batch = []
+
+    def flush():
+        nonlocal loaded
+        Product.copy_rows(batch)
+        # Committed with the rows, so the stats hold up if a later batch fails
+        ProductStats.apply(db.session.connection(), [(row["category"], 1, row["available"], row["price"]) for row in batch])
+        db.session.commit()
+        loaded += len(batch)
+        batch.clear()
+        rate = loaded / max(time.monotonic() - started, 1e-9)
+        click.echo(f"Loaded {loaded} products, rejected {rejected} ({rate:.0f} rows/s)", err=True)
+
+    for line, record in transfer.read_records(source, fmt):
+        try:
+            batch.append(transfer.validate(record))
+        except DataValidationError as error:
+            rejected += 1
+            rejects.write(json.dumps({"line": line, "error": str(error), "record": record}) + "\n")
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    click.echo(f"Imported {loaded} products, rejected {rejected}", err=True)
+
+
+######################################################################
+# Command to dump products to a file
+# Usage: flask products-export --category FOOD products.csv
+######################################################################
+@commands.cli.command("products-export")
+@click.argument("output", type=click.File("wb"), default="-")
+@click.option("--format", "fmt", type=click.Choice(transfer.EXPORT_FORMATS), help="Defaults to the file extension.")
+@click.option("--fields", help="Comma separated columns to export. Defaults to all of them.")
+@click.option("--name", help="Only products with this name.")
+@click.option("--category", type=click.Choice([category.name for category in Category], case_sensitive=False))
+@click.option("--available/--unavailable", default=None, help="Only available or unavailable products.")
+@click.option("--min-price", type=float)
+@click.option("--max-price", type=float)
+@click.option("-q", "--q", help="Only products matching this text search.")
+@click.option("--batch-size", type=int, help="Rows fetched per round trip. Defaults to STREAM_BATCH_SIZE.")
+def products_export(output, fmt, fields, batch_size, **filters):
+    """
+    Writes Products to a CSV, NDJSON or Parquet file or to stdout
+
+    The filters are the ones GET /products takes. Rows are read through a
+    server-side cursor in batches, or with COPY for CSV on PostgreSQL, so
+    memory stays flat no matter how large the table is.
+    """
+    fmt = fmt or transfer.guess_format(getattr(output, "name", "-"))
+    batch_size = batch_size or app.config["STREAM_BATCH_SIZE"]
+    filters = {key: value for key, value in filters.items() if value is not None}
+    if "category" in filters:
+        filters["category"] = Category[filters["category"].upper()]
+    try:
+        fields = serializers.parse_fields(fields)
+    except DataValidationError as error:
+        raise click.BadParameter(str(error), param_hint="--fields") from error
+    query = serializers.project(Product.search("id", **filters), fields)
+    started = time.monotonic()
+    try:
+        if fmt == "csv" and db.engine.dialect.name == "postgresql":
+            count = transfer.copy_csv(query, output)
+        else:
+            rows = Product.stream(query, batch_size)
+            if fmt == "parquet":
+                count = transfer.write_parquet(rows, fields, output, batch_size)
+            elif fmt == "csv":
+                count = transfer.write_csv(rows, fields, output)
+            else:
+                count = transfer.write_ndjson(rows, fields, output)
+    except RuntimeError as error:
+        raise click.ClickException(str(error)) from error
+    elapsed = max(time.monotonic() - started, 1e-9)
+    click.echo(f"Exported {count} products ({count / elapsed:.0f} rows/s)", err=True)
+
+
+######################################################################
+# Command to sum up the slow query log
+# Usage: flask slow-queries --top 10
+######################################################################
+@commands.cli.command("slow-queries")
+@click.argument("log", type=click.Path(exists=True, dir_okay=False), required=False)
+@click.option("--top", default=20, show_default=True, help="Number of statement shapes to show.")
+@click.option("--sort", type=click.Choice(["total", "count", "mean", "max"]), default="total", show_default=True)
+def slow_queries_report(log, top, sort):
+    """
+    Shows the slow statements of LOG grouped by shape
+
+    LOG defaults to SLOW_QUERY_LOG. Statements that only differ in their
+    values share a shape.
+    """
+    log = log or app.config["SLOW_QUERY_LOG"]
+    if not log:
+        raise click.UsageError("Pass a LOG file or set SLOW_QUERY_LOG")
+    shapes = slow_queries.aggregate(slow_queries.read_log(log))
+    key = "count" if sort == "count" else f"{sort}_ms"
+    shapes.sort(key=lambda shape: shape[key], reverse=True)
+    click.echo(f"{'count':>7} {'total ms':>11} {'mean ms':>9} {'max ms':>9}  statement")
+    for shape in shapes[:top]:
+        click.echo(
+            f"{shape['count']:>7} {shape['total_ms']:>11.1f} {shape['mean_ms']:>9.1f} {shape['max_ms']:>9.1f}  "
+            f"{shape['shape']}"
+        )
+        click.echo(f"{'':>41}  from {', '.join(shape['routes'])}")
+
+
+######################################################################
+# Command to put a running service under load
+# Usage: flask products-loadtest --url http://localhost:8080 --rate 200
+######################################################################
+@commands.cli.command("products-loadtest")
+@click.option("--url", default="http://localhost:8080", show_default=True, help="Base URL of the service.")
+@click.option("--mix", default=loadtest.DEFAULT_MIX, show_default=True, help="Weights of the routes to send.")
+@click.option("--duration", default=30.0, show_default=True, help="Seconds to run for.")
+@click.option("--concurrency", default=10, show_default=True, help="Connections open at once.")
+@click.option("--rate", type=float, help="Requests started per second. Without it every connection sends back to back.")
+@click.option("--timeout", default=10.0, show_default=True, help="Seconds before a request counts as failed.")
+@click.option("--seed", type=int, help="Seed of the random route and product picks.")
+@click.option("--output", type=click.File("w"), help="Where to write the report as JSON.")
+def products_loadtest(url, mix, duration, concurrency, rate, timeout, seed, output):
+    """
+    Sends a mix of requests to a running service and reports how it held up
+
+    The routes of --mix are get, list, create, update and delete. With
+    --rate requests start on schedule and latency counts from when they
+    were due, so queueing in the client shows up in the percentiles.
+    """
+    # pylint: disable=too-many-arguments
+    try:
+        weights = loadtest.parse_mix(mix)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--mix") from error
+    test = loadtest.LoadTest(url, weights, duration, concurrency, rate, timeout, seed)
+    click.echo(f"Sending {mix} to {url} for {duration:g}s...", err=True)
+    try:
+        report = asyncio.run(test.run())
+    except (OSError, loadtest.HTTPError) as error:
+        raise click.ClickException(f"Could not reach {url}: {error}") from error
+    click.echo(f"{'route':<8} {'requests':>9} {'errors':>7} {'error %':>8} {'req/s':>9} "
+               f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for route, result in report["routes"].items():
+        click.echo(
+            f"{route:<8} {result['requests']:>9} {result['errors']:>7} {result['error_rate'] * 100:>8.2f} "
+            f"{result['throughput']:>9.1f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f}"
+        )
+    if output:
+        json.dump(report, output, indent=2)
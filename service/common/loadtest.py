@@ -0,0 +1,341 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: loadtest
+
+Drives a running Product service over HTTP with a mix of its routes,
+either at a fixed request rate (open loop) or with a fixed number of
+clients that send one request after another (closed loop), and reports
+the latency percentiles, throughput and error rate of each route.
+
+It speaks plain HTTP/1.1 with keep-alive over asyncio streams, so it
+needs nothing but the standard library and a reachable server, such
+as one on localhost. Reads pick from the products the server already
+has and the ones the test made, updates and deletes only touch products
+that the test made, and those still left are deleted when it ends.
+"""
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+from service.models import Category
+
+ROUTES = ("get", "list", "create", "update", "delete")
+DEFAULT_MIX = "get=60,list=25,create=5,update=5,delete=5"
+# Products deleted per request when cleaning up, the default MAX_IDS
+CLEANUP_BATCH_SIZE = 1000
+
+
+class HTTPError(Exception):
+    """Used when a response cannot be read"""
+
+
+def parse_mix(value):
+    """Returns the route weights of a mix like 'get=60,list=40'"""
+    mix = {}
+    for part in value.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route {route!r}, use {', '.join(ROUTES)}")
+        mix[route] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("The mix needs a route with a weight above 0")
+    return mix
+
+
+def percentile(timings, share):
+    """Returns the value below which the given share of sorted timings fall"""
+    if not timings:
+        return 0.0
+    return timings[min(int(len(timings) * share), len(timings) - 1)]
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        """Sends a request and returns its status and body, reconnecting when needed"""
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Length: {len(payload)}\r\n"
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        self.writer.write(head.encode("ascii") + b"\r\n" + payload)
+        try:
+            status, headers = await self.read_head()
+            data = await self.read_body(headers)
+        except (asyncio.IncompleteReadError, ValueError) as error:
+            self.close()
+            raise HTTPError(f"Bad response: {error}") from error
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, data
+
+    async def read_head(self):
+        """Reads the status line and headers of a response"""
+        line = await self.reader.readuntil(b"\r\n")
+        status = int(line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                return status, headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def read_body(self, headers):
+        """Reads a body sent with a Content-Length or in chunks"""
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunks.append(await self.reader.readexactly(size + 2))
+                if size == 0:
+                    return b"".join(chunk[:-2] for chunk in chunks)
+        return await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+    def close(self):
+        """Closes the connection, the next request opens a new one"""
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = None
+
+
+class LoadTest:  # pylint: disable=too-many-instance-attributes
+    """A load test against the service at base_url"""
+
+    def __init__(self, base_url, mix, duration, concurrency=10,  # pylint: disable=too-many-arguments
+                 rate=None, timeout=10.0, seed=None):
+        url = urlsplit(base_url)
+        self.host = url.hostname or "localhost"
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip("/")
+        self.routes = list(mix)
+        self.weights = list(mix.values())
+        self.duration = duration
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.ids = []
+        self.created = []
+        self.deleted = set()
+        # Products with an update or delete on its way, which others leave alone
+        self.writing = set()
+        self.timings = {route: [] for route in self.routes}
+        self.errors = {route: 0 for route in self.routes}
+        self.elapsed = 0.0
+
+    async def call(self, connection, route, due=None):
+        """
+        Sends one request of the given route and records how it went
+
+        Latency counts from due when given, else from when the request
+        was started. Any answer but the expected status is an error, except
+        a 404 for a product the test deleted while the request was on its way.
+        """
+        started = due or time.perf_counter()
+        passed = False
+        product_id = None
+        try:
+            method, path, body, expected, product_id = await self.build(connection, route)
+            status, data = await asyncio.wait_for(connection.request(method, self.prefix + path, body), self.timeout)
+            passed = status == expected or (status == 404 and product_id in self.deleted)
+            if passed and route == "create":
+                self.keep(json.loads(data)["id"])
+            elif passed and route == "delete":
+                self.forget(product_id)
+        except (OSError, HTTPError, asyncio.TimeoutError, ValueError, KeyError):
+            connection.close()
+            passed = False
+        finally:
+            if route in ("update", "delete"):
+                self.writing.discard(product_id)
+        self.timings[route].append(time.perf_counter() - started)
+        if not passed:
+            self.errors[route] += 1
+
+    async def build(self, connection, route):
+        """Returns the method, path, body and expected status of a request and the product it is about"""
+        if route == "list":
+            category = self.random.choice(list(Category)).name
+            return "GET", f"/products?category={category}&limit=100", None, 200, None
+        if route == "create":
+            return "POST", "/products", self.product(), 201, None
+        if route in ("update", "delete"):
+            product_id = await self.pick_own(connection)
+            self.writing.add(product_id)
+            if route == "update":
+                return "PUT", f"/products/{product_id}", self.product(), 200, product_id
+            self.deleted.add(product_id)
+            return "DELETE", f"/products/{product_id}", None, 204, product_id
+        if not self.ids:
+            await self.setup_product(connection)
+        product_id = self.random.choice(self.ids)
+        return "GET", f"/products/{product_id}", None, 200, product_id
+
+    async def pick_own(self, connection):
+        """Returns a product the test made that no other update or delete is working on"""
+        free = [product_id for product_id in self.created if product_id not in self.writing]
+        if not free:
+            free.append(await self.setup_product(connection))
+        return self.random.choice(free)
+
+    def keep(self, product_id):
+        """Adds a product made by the test to the ones to read, update and delete"""
+        self.ids.append(product_id)
+        self.created.append(product_id)
+
+    def forget(self, product_id):
+        """Drops a deleted product from the ones to read, update and clean up"""
+        self.created.remove(product_id)
+        if product_id in self.ids:
+            self.ids.remove(product_id)
+
+    async def setup_product(self, connection):
+        """Creates a product outside of the measurements and returns its id"""
+        status, data = await connection.request("POST", self.prefix + "/products", self.product())
+        if status != 201:
+            raise HTTPError(f"Could not create a product: {status} {data[:200]!r}")
+        product_id = json.loads(data)["id"]
+        self.keep(product_id)
+        return product_id
+
+    def product(self):
+        """Returns the body of a random product"""
+        return {
+            "name": f"Load test {self.random.randrange(1 << 30)}",
+            "description": "Made by flask products-loadtest",
+            "price": round(self.random.uniform(1, 1000), 2),
+            "available": self.random.random() < 0.8,
+            "category": self.random.choice(list(Category)).name,
+        }
+
+    def pick(self):
+        """Returns a route drawn by the weights of the mix"""
+        return self.random.choices(self.routes, self.weights)[0]
+
+    async def load_ids(self):
+        """Reads the ids of up to 1000 existing products to read and update"""
+        connection = Connection(self.host, self.port)
+        try:
+            status, data = await connection.request("GET", self.prefix + "/products?limit=1000&fields=id")
+        finally:
+            connection.close()
+        if status != 200:
+            raise HTTPError(f"GET /products answered {status}")
+        self.ids = [product["id"] for product in json.loads(data)]
+
+    async def cleanup(self):
+        """Deletes the products the test made that are still there"""
+        connection = Connection(self.host, self.port)
+        try:
+            while self.created:
+                ids = self.created[-CLEANUP_BATCH_SIZE:]
+                status, data = await connection.request("DELETE", self.prefix + "/products", {"ids": ids})
+                if status != 200:
+                    raise HTTPError(f"Could not delete the test products: {status} {data[:200]!r}")
+                del self.created[-CLEANUP_BATCH_SIZE:]
+                self.deleted.update(ids)
+        finally:
+            connection.close()
+
+    async def closed_loop(self, deadline):
+        """Keeps concurrency clients busy sending one request after another"""
+        async def client():
+            connection = Connection(self.host, self.port)
+            while time.perf_counter() < deadline:
+                await self.call(connection, self.pick())
+            connection.close()
+        await asyncio.gather(*[client() for _ in range(self.concurrency)])
+
+    async def open_loop(self, deadline):
+        """
+        Starts requests at the target rate whether or not earlier ones finished
+
+        Latency is measured from when a request was due, so time spent
+        waiting for one of the concurrency connections counts against it.
+        """
+        connections = asyncio.Queue()
+        for _ in range(self.concurrency):
+            connections.put_nowait(Connection(self.host, self.port))
+
+        async def request(route, due):
+            connection = await connections.get()
+            try:
+                await self.call(connection, route, due)
+            finally:
+                connections.put_nowait(connection)
+
+        tasks = []
+        started = time.perf_counter()
+        sent = 0
+        while True:
+            due = started + sent / self.rate
+            if due >= deadline:
+                break
+            await asyncio.sleep(max(due - time.perf_counter(), 0))
+            tasks.append(asyncio.ensure_future(request(self.pick(), due)))
+            sent += 1
+        await asyncio.gather(*tasks)
+        while not connections.empty():
+            connections.get_nowait().close()
+
+    async def run(self):
+        """Runs the load test and returns its report"""
+        await self.load_ids()
+        started = time.perf_counter()
+        deadline = started + self.duration
+        try:
+            if self.rate:
+                await self.open_loop(deadline)
+            else:
+                await self.closed_loop(deadline)
+            self.elapsed = time.perf_counter() - started
+        finally:
+            await self.cleanup()
+        return self.report()
+
+    def report(self):
+        """Returns the requests, errors, throughput and latency of each route and overall"""
+        routes = dict(self.timings, all=[timing for timings in self.timings.values() for timing in timings])
+        errors = dict(self.errors, all=sum(self.errors.values()))
+        results = {}
+        for route, timings in routes.items():
+            timings = sorted(timings)
+            results[route] = {
+                "requests": len(timings),
+                "errors": errors[route],
+                "error_rate": round(errors[route] / len(timings), 4) if timings else 0.0,
+                "throughput": round(len(timings) / self.elapsed, 1) if self.elapsed else 0.0,
+                "p50_ms": round(percentile(timings, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(timings, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(timings, 0.99) * 1000, 2),
+            }
+        return {
+            "duration": round(self.elapsed, 2),
+            "mode": f"rate {self.rate}/s" if self.rate else f"concurrency {self.concurrency}",
+            "routes": results,
+        }
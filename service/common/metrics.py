@@ -0,0 +1,154 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: metrics
+
+Prometheus metrics for the requests, database statements and response
+serialization of the service, exported by GET /metrics.
+
+When PROMETHEUS_MULTIPROC_DIR is set every worker process writes its
+samples to that directory and /metrics adds them up, so the numbers are
+the same whichever gunicorn worker answers the scrape.
+"""
+import os
+import time
+from contextlib import contextmanager
+from flask import Blueprint, g, request, has_request_context
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+from prometheus_client import CONTENT_TYPE_LATEST
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled", ["method", "route", "status"]
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time taken to build HTTP responses", ["method", "route", "status"]
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database statements run per HTTP request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in database statements per HTTP request", ["route"]
+)
+SERIALIZATION_SECONDS = Histogram(
+    "serialization_seconds", "Time spent turning rows into response bodies", ["route"]
+)
+PRODUCTS_RETURNED = Histogram(
+    "products_returned", "Products returned per list request", ["route"],
+    buckets=(0, 1, 10, 100, 1000, 10000, 100000, 1000000),
+)
+CACHE_LOOKUPS = Counter(
+    "product_cache_lookups_total", "Product cache lookups by result", ["result"]
+)
+
+# Registered on the app to time every request, not only those of a blueprint
+hooks = Blueprint("metrics", __name__)
+
+
+def render():
+    """Returns the current samples in the Prometheus text format and its content type"""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def route():
+    """Returns the URL rule of the current request, which keeps label values few"""
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@contextmanager
+def serialization():
+    """Times the block as serialization of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SERIALIZATION_SECONDS.labels(route()).observe(time.perf_counter() - started)
+
+
+def products_returned(count):
+    """Records how many Products the current request returned"""
+    PRODUCTS_RETURNED.labels(route()).observe(count)
+
+
+def cache_lookup(hit):
+    """Records a hit or a miss of the Product cache"""
+    CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+
+
+class RequestMetrics:  # pylint: disable=too-few-public-methods
+    """Time and database work of one request, recorded when its response is closed"""
+
+    __slots__ = ("started", "db_queries", "db_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    def record(self, method, rule, status):
+        """Adds the request to the request metrics"""
+        REQUESTS.labels(method, rule, status).inc()
+        REQUEST_SECONDS.labels(method, rule, status).observe(time.perf_counter() - self.started)
+        REQUEST_DB_QUERIES.labels(rule).observe(self.db_queries)
+        REQUEST_DB_SECONDS.labels(rule).observe(self.db_seconds)
+
+
+######################################################################
+# Request hooks
+######################################################################
+@hooks.before_app_request
+def start_request():
+    """Starts timing a request and counting its database statements"""
+    g.request_metrics = RequestMetrics()
+
+
+@hooks.after_app_request
+def record_request(response):
+    """
+    Records the request once its response is closed
+
+    Waiting for the close counts the rows and statements of streamed
+    responses, which are produced after this hook runs.
+    """
+    request_metrics = g.get("request_metrics")
+    if request_metrics is not None:
+        labels = (request.method, route(), str(response.status_code))
+        response.call_on_close(lambda: request_metrics.record(*labels))
+    return response
+
+
+######################################################################
+# Database hooks
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(_conn, _cursor, _statement, _parameters, context, _executemany):  # pylint: disable=too-many-arguments
+    """Notes when a statement was sent to the database"""
+    context.metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_statement(_conn, _cursor, _statement, _parameters, context, _executemany):  # pylint: disable=too-many-arguments
+    """Adds a finished statement to the database work of the current request"""
+    request_metrics = g.get("request_metrics") if has_request_context() else None
+    if request_metrics is not None:
+        request_metrics.db_queries += 1
+        request_metrics.db_seconds += time.perf_counter() - context.metrics_started
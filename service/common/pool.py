@@ -0,0 +1,100 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Database Connection Pool
+
+This module contains a QueuePool that records how long requests wait
+for a connection, a helper to open the pool of a freshly forked worker
+before it takes traffic, and the usage numbers shown by /metrics/pool.
+"""
+import logging
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("flask.app")
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that counts checkouts, the time spent waiting for them and timeouts"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+def stats(pool):
+    """Returns the size, usage and wait counters of a connection pool"""
+    data = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        data.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+            in_use=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        data.update(
+            checkouts=pool.checkouts,
+            timeouts=pool.timeouts,
+            wait_seconds=round(pool.wait_seconds, 6),
+            max_wait_seconds=round(pool.max_wait_seconds, 6),
+        )
+    return data
+
+
+def warm_up(engine, count):
+    """
+    Opens ``count`` connections of a worker's pool ahead of its first request
+
+    Connections inherited from a parent process are dropped first without
+    being closed, as they belong to the parent. A database that is not
+    reachable yet is only logged, the pool will connect on demand.
+    """
+    engine.dispose(close=False)
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    except exc.SQLAlchemyError as error:
+        logger.warning("Could not pre-open database connections: %s", error)
+    finally:
+        for connection in connections:
+            connection.close()
+    logger.info("Pre-opened %s database connections", len(connections))
+    return len(connections)
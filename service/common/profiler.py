@@ -0,0 +1,161 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: profiler
+
+Opt-in profiling of single requests. When PROFILING_ENABLED is set, a
+request that sends an ``X-Profile`` header, and a random share of
+PROFILE_SAMPLE_RATE of all requests, runs under cProfile with its SQL
+statements timed. The response carries a ``Server-Timing`` header and
+the functions that took the most time in ``X-Profile-Top``. With a
+PROFILE_DIR the full profile (``.prof``, readable by pstats or snakeviz)
+and the statements (``.sql.json``) are written there and named by the
+``X-Profile-Id`` header.
+
+Nothing is installed when profiling is disabled, so it costs nothing.
+"""
+import cProfile
+import contextvars
+import json
+import os
+import pstats
+import random
+import re
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statements of the request being profiled, None when there is none
+STATEMENTS = contextvars.ContextVar("profiled_statements", default=None)
+TOP_FUNCTIONS = 5
+
+
+class ProfilerMiddleware:
+    """WSGI middleware that profiles the requests that ask for it or are sampled"""
+
+    def __init__(self, app, sample_rate=0.0, directory=None,  # pylint: disable=too-many-arguments
+                 header="X-Profile", sampler=random.random):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.environ_key = "HTTP_" + header.upper().replace("-", "_")
+        self.sampler = sampler
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        asked = environ.get(self.environ_key, "").lower() not in ["", "0", "false", "no"]
+        if not asked and not (self.sample_rate and self.sampler() < self.sample_rate):
+            return self.app(environ, start_response)
+        return self.profile(environ, start_response)
+
+    def profile(self, environ, start_response):
+        """Runs a request under the profiler and reports on it"""
+        profile = cProfile.Profile()
+        statements = []
+        STATEMENTS.set(statements)
+        started = time.perf_counter()
+        name = f"{time.time_ns()}-{environ['REQUEST_METHOD']}-{re.sub(r'[^A-Za-z0-9]+', '_', environ['PATH_INFO']).strip('_')}"
+
+        def profiled_start_response(status, headers, exc_info=None):
+            profile.disable()
+            headers = list(headers) + self.headers(profile, statements, time.perf_counter() - started, name)
+            profile.enable()
+            return start_response(status, headers, exc_info)
+
+        profile.enable()
+        try:
+            body = self.app(environ, profiled_start_response)
+        finally:
+            profile.disable()
+        return self.iterate(body, profile, statements, name)
+
+    def iterate(self, body, profile, statements, name):
+        """Yields the response body, profiling the work done to produce it"""
+        try:
+            iterator = iter(body)
+            while True:
+                profile.enable()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    profile.disable()
+                yield chunk
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+            STATEMENTS.set(None)
+            if self.directory:
+                self.write(profile, statements, name)
+
+    def headers(self, profile, statements, elapsed, name):
+        """Returns the debug headers that summarize a profile"""
+        db_seconds = sum(statement["seconds"] for statement in statements)
+        timing = f'app;dur={elapsed * 1000:.1f}, db;dur={db_seconds * 1000:.1f};desc="{len(statements)} queries"'
+        headers = [("Server-Timing", timing), ("X-Profile-Top", ", ".join(top_functions(profile)))]
+        if self.directory:
+            headers.append(("X-Profile-Id", name))
+        return headers
+
+    def write(self, profile, statements, name):
+        """Writes a profile and its statements to the profile directory"""
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + ".prof")
+        with open(path + ".sql.json", "w", encoding="utf-8") as output:
+            json.dump(statements, output, indent=2, default=str)
+
+
+def top_functions(profile, count=TOP_FUNCTIONS):
+    """Returns the functions with the most time spent in themselves as short strings"""
+    entries = pstats.Stats(profile).stats.items()
+    slowest = sorted(entries, key=lambda entry: entry[1][2], reverse=True)[:count]
+    return [
+        f"{function} ({os.path.basename(filename)}:{line}) {own_time * 1000:.1f}ms"
+        for (filename, line, function), (_, _, own_time, _, _) in slowest
+    ]
+
+
+def record_start(_conn, _cursor, _statement, _parameters, context, _executemany):  # pylint: disable=too-many-arguments
+    """Notes when a statement of a profiled request was sent"""
+    if STATEMENTS.get() is not None:
+        context.profile_started = time.perf_counter()
+
+
+def record_statement(_conn, _cursor, statement, parameters, context, _executemany):  # pylint: disable=too-many-arguments
+    """Keeps a finished statement of a profiled request with its time"""
+    statements = STATEMENTS.get()
+    if statements is not None and hasattr(context, "profile_started"):
+        statements.append({
+            "statement": statement,
+            "parameters": parameters,
+            "seconds": time.perf_counter() - context.profile_started,
+        })
+
+
+def init_app(app):
+    """Wraps the app in the ProfilerMiddleware when PROFILING_ENABLED is set"""
+    if not app.config.get("PROFILING_ENABLED"):
+        return
+    app.wsgi_app = ProfilerMiddleware(
+        app.wsgi_app,
+        sample_rate=app.config.get("PROFILE_SAMPLE_RATE", 0.0),
+        directory=app.config.get("PROFILE_DIR") or None,
+    )
+    event.listen(Engine, "before_cursor_execute", record_start)
+    event.listen(Engine, "after_cursor_execute", record_statement)
+    app.logger.warning("Request profiling is enabled")
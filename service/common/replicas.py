@@ -0,0 +1,156 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Read Replicas
+
+This module sends plain SELECT statements to read replicas listed in
+DATABASE_REPLICA_URIS while writes stay on the primary database.
+
+A session stays on the primary from its first write on, so a request
+always reads what it wrote. Requests that are not GET or HEAD use the
+primary for every statement, and a client that wrote keeps reading from
+the primary for REPLICA_STICKY_SECONDS through a cookie, which covers
+replication lag between its requests.
+"""
+import itertools
+import logging
+import threading
+import time
+from flask import current_app, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, exc
+from sqlalchemy.sql import Select
+from service.common import pool
+
+logger = logging.getLogger("flask.app")
+
+# Key of Session.info that pins a session to the primary
+USE_PRIMARY = "use_primary"
+# Cookie holding the time until which a client reads from the primary
+STICKY_COOKIE = "read_primary_until"
+READ_METHODS = ("GET", "HEAD")
+
+
+class ReplicaSet:
+    """
+    Round-robin over the engines of the read replicas
+
+    Each replica is checked with a ``SELECT 1`` at most once per
+    ``interval`` seconds when it is picked, one that fails is skipped
+    until its next check.
+    """
+
+    def __init__(self, engines, interval=10.0, timer=time.monotonic):
+        self.engines = list(engines)
+        self.interval = interval
+        self.timer = timer
+        self._healthy = {id(engine): True for engine in self.engines}
+        self._next_check = {id(engine): 0.0 for engine in self.engines}
+        self._cycle = itertools.cycle(self.engines)
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Returns the next healthy replica engine or None when there is none"""
+        for _ in range(len(self.engines)):
+            with self._lock:
+                engine = next(self._cycle)
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+    def is_healthy(self, engine):
+        """Returns the state of a replica, checking it again when it is due"""
+        key = id(engine)
+        now = self.timer()
+        if now < self._next_check[key]:
+            return self._healthy[key]
+        self._next_check[key] = now + self.interval
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+            healthy = True
+        except exc.SQLAlchemyError as error:
+            logger.warning("Read replica %s is not available: %s", engine.url.render_as_string(), error)
+            healthy = False
+        self._healthy[key] = healthy
+        return healthy
+
+    def stats(self):
+        """Returns the health and pool stats of every replica"""
+        return [
+            dict(pool.stats(engine.pool), url=engine.url.render_as_string(), healthy=self._healthy[id(engine)])
+            for engine in self.engines
+        ]
+
+
+class RoutingSession(Session):  # pylint: disable=too-few-public-methods
+    """Session that runs plain SELECT statements on a read replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if isinstance(clause, Select) and not self._flushing and not self.info.get(USE_PRIMARY):
+                replicas = current_app.extensions.get("replicas") if has_app_context() else None
+                engine = replicas.choose() if replicas else None
+                if engine is not None:
+                    return engine
+            else:
+                self.info[USE_PRIMARY] = True
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+def lag(session):
+    """Returns how many seconds the reads of a session may be behind the primary, or None on the primary"""
+    if not has_app_context() or "replicas" not in current_app.extensions or session.info.get(USE_PRIMARY):
+        return None
+    return current_app.config.get("REPLICA_STICKY_SECONDS", 5.0)
+
+
+def init_app(app, database):
+    """
+    Routes the database session through the replicas in DATABASE_REPLICA_URIS
+
+    The session and request hooks are always installed so replicas can be
+    added to app.extensions later, they do nothing while there are none.
+    """
+    factory = database.session.session_factory
+    if not issubclass(factory.class_, RoutingSession):
+        # Subclass the current class so the session events registered on it still apply
+        factory.class_ = type("RoutingSession", (RoutingSession, factory.class_), {})
+    uris = app.config.get("DATABASE_REPLICA_URIS")
+    if uris:
+        options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+        engines = [create_engine(uri, **options) for uri in uris]
+        app.extensions["replicas"] = ReplicaSet(engines, app.config.get("REPLICA_HEALTH_INTERVAL", 10.0))
+
+    @app.before_request
+    def use_primary():  # pylint: disable=unused-variable
+        """Pins the session of writes and of clients that just wrote to the primary"""
+        if "replicas" not in app.extensions:
+            return
+        try:
+            sticky = float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        if request.method not in READ_METHODS or sticky:
+            database.session.info[USE_PRIMARY] = True
+
+    @app.after_request
+    def stick_to_primary(response):  # pylint: disable=unused-variable
+        """Keeps a client that wrote on the primary while the replicas catch up"""
+        if "replicas" in app.extensions and request.method not in READ_METHODS and response.status_code < 400:
+            seconds = app.config.get("REPLICA_STICKY_SECONDS", 5.0)
+            response.set_cookie(STICKY_COOKIE, f"{time.time() + seconds:.3f}", max_age=int(seconds) + 1, httponly=True)
+        return response
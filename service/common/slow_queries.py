@@ -0,0 +1,203 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+"""
+Module: slow_queries
+
+Times every SQL statement and logs the ones slower than
+SLOW_QUERY_THRESHOLD_MS with their parameters and the route that ran
+them. With SLOW_QUERY_EXPLAIN the plan of a slow SELECT is logged too,
+from ``EXPLAIN (ANALYZE, BUFFERS)`` on PostgreSQL and ``EXPLAIN QUERY
+PLAN`` on SQLite. Records are appended to SLOW_QUERY_LOG as newline
+delimited JSON, which ``flask slow-queries`` sums up by statement shape.
+"""
+import json
+import logging
+import re
+import time
+from datetime import datetime
+from flask import request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("flask.app")
+
+# Longest parameter repr kept in a record
+MAX_PARAMETERS = 1000
+
+EXPLAIN = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+
+def normalize(statement):
+    """
+    Returns the shape of a statement
+
+    Literals and bound parameters become ``?`` and lists of them
+    (IN lists, multi-row VALUES) become ``(...)``, so statements that
+    only differ in their values share a shape.
+    """
+    shape = re.sub(r"\s+", " ", statement).strip()
+    shape = re.sub(r"%\(\w+\)s|%s|(?<!:):[A-Za-z_]\w*|\$\d+|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b", "?", shape)
+    shape = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(...)", shape)
+    return re.sub(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+", "(...)", shape)
+
+
+def aggregate(records):
+    """Returns the count and timings of slow statements by shape, slowest in total first"""
+    shapes = {}
+    for record in records:
+        shape = shapes.setdefault(record["shape"], {
+            "shape": record["shape"], "count": 0, "total_ms": 0.0, "max_ms": 0.0, "routes": set(),
+        })
+        shape["count"] += 1
+        shape["total_ms"] += record["ms"]
+        shape["max_ms"] = max(shape["max_ms"], record["ms"])
+        shape["routes"].add(record.get("route") or "-")
+    results = []
+    for shape in shapes.values():
+        shape["mean_ms"] = shape["total_ms"] / shape["count"]
+        shape["routes"] = sorted(shape["routes"])
+        results.append(shape)
+    return sorted(results, key=lambda shape: shape["total_ms"], reverse=True)
+
+
+def read_log(path):
+    """Yields the records of a slow query log, skipping lines that are not JSON"""
+    with open(path, encoding="utf-8") as source:
+        for line in source:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class SlowQueryLog:
+    """Engine event listeners that record statements slower than a threshold"""
+
+    def __init__(self, threshold_ms, explain=False, path=None):
+        self.threshold = threshold_ms / 1000
+        self.explain = explain
+        self.path = path
+        self.targets = []
+
+    def listen(self, targets=(Engine,)):
+        """Starts timing the statements of the given engines, or of every engine"""
+        for target in targets:
+            event.listen(target, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(target, "after_cursor_execute", self.after_cursor_execute)
+            self.targets.append(target)
+
+    def remove(self):
+        """Stops timing statements"""
+        for target in self.targets:
+            event.remove(target, "before_cursor_execute", self.before_cursor_execute)
+            event.remove(target, "after_cursor_execute", self.after_cursor_execute)
+        self.targets = []
+
+    def before_cursor_execute(self, _conn, _cursor, _statement,  # pylint: disable=too-many-arguments
+                              _parameters, context, _executemany):
+        """Notes when a statement was sent"""
+        context.slow_query_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement,  # pylint: disable=too-many-arguments
+                             parameters, context, executemany):
+        """Records the statement when it took longer than the threshold"""
+        elapsed = time.perf_counter() - context.slow_query_started
+        if elapsed < self.threshold:
+            return
+        record = {
+            "time": datetime.utcnow().isoformat(),
+            "ms": round(elapsed * 1000, 3),
+            "route": route(),
+            "statement": statement,
+            "shape": normalize(statement),
+            "parameters": format_parameters(parameters, executemany),
+        }
+        if self.explain and not executemany and statement.lstrip()[:6].upper() == "SELECT":
+            record["plan"] = explain_plan(cursor, statement, parameters, conn.dialect.name)
+        logger.warning("Slow query (%.1f ms) from %s: %s %s", record["ms"], record["route"], statement, record["parameters"])
+        if record.get("plan"):
+            logger.warning("Plan:\n%s", record["plan"])
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as output:
+                output.write(json.dumps(record, default=str) + "\n")
+
+
+def route():
+    """Returns the method and URL rule of the current request, or None outside of one"""
+    if not has_request_context():
+        return None
+    return f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+
+
+def format_parameters(parameters, executemany):
+    """Returns the parameters of a statement as a string of bounded length"""
+    if executemany:
+        text = f"{len(parameters)} rows, first: {parameters[0]!r}" if parameters else "0 rows"
+    else:
+        text = repr(parameters)
+    return text if len(text) <= MAX_PARAMETERS else text[:MAX_PARAMETERS] + "..."
+
+
+def explain_plan(cursor, statement, parameters, dialect):
+    """
+    Returns the plan of a SELECT that just ran, or why there is none
+
+    The plan is read on the same connection with a new DBAPI cursor, which
+    does not fire engine events. On PostgreSQL it runs in a savepoint so a
+    failure cannot break the transaction of the caller.
+    """
+    prefix = EXPLAIN.get(dialect)
+    if prefix is None:
+        return None
+    plan_cursor = cursor.connection.cursor()
+    savepoint = dialect == "postgresql"
+    try:
+        if savepoint:
+            plan_cursor.execute("SAVEPOINT slow_query_explain")
+        plan_cursor.execute(prefix + statement, parameters)
+        lines = [str(row[-1]) for row in plan_cursor.fetchall()]
+        if savepoint:
+            plan_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return "\n".join(lines)
+    except Exception as error:  # pylint: disable=broad-except
+        if savepoint:
+            plan_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+        return f"EXPLAIN failed: {error}"
+    finally:
+        plan_cursor.close()
+
+
+def init_app(app, database):
+    """
+    Starts the slow query log unless SLOW_QUERY_THRESHOLD_MS is negative
+
+    The listeners are bound to the engines of this app and its replicas,
+    so making more apps does not time every statement more than once.
+    """
+    threshold = app.config.get("SLOW_QUERY_THRESHOLD_MS", 200)
+    if threshold < 0:
+        return None
+    log = SlowQueryLog(threshold, app.config.get("SLOW_QUERY_EXPLAIN", False), app.config.get("SLOW_QUERY_LOG") or None)
+    with app.app_context():
+        engines = list(database.engines.values())
+    if "replicas" in app.extensions:
+        engines.extend(app.extensions["replicas"].engines)
+    log.listen(engines)
+    app.extensions["slow_queries"] = log
+    return log
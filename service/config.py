@@ -13,8 +13,67 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Connection pool of each worker process
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_recycle": int(os.getenv("SQLALCHEMY_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("SQLALCHEMY_POOL_PRE_PING", "true").lower() in ["true", "yes", "1"],
+}
+# An in-memory SQLite database lives in a single shared connection
+if DATABASE_URI not in ["sqlite://", "sqlite:///:memory:"]:
+    SQLALCHEMY_ENGINE_OPTIONS.update(
+        pool_size=int(os.getenv("SQLALCHEMY_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("SQLALCHEMY_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("SQLALCHEMY_POOL_TIMEOUT", "30")),
+    )
+
+# Read replicas for plain reads, as a comma separated list of database URIs
+DATABASE_REPLICA_URIS = [uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()]
+# Seconds between health checks of a replica
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "10"))
+# Seconds a client keeps reading from the primary after a write, which is
+# also the longest a Product read from a replica stays in the cache
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+# Connections each worker opens right after it is forked
+SQLALCHEMY_POOL_PREOPEN = int(os.getenv("SQLALCHEMY_POOL_PREOPEN", str(SQLALCHEMY_ENGINE_OPTIONS.get("pool_size", 0))))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
+
+# Largest page a client may ask for with ?limit= on list endpoints
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Most ids a client may look up or delete at once with ?ids= or an "ids" body
+MAX_IDS = int(os.getenv("MAX_IDS", "1000"))
+
+# Rows fetched per round trip when streaming product lists
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Rows sent per multi-row INSERT by POST /products/batch
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Cache for Product.find: "none" (the default), "memory" or "redis".
+# "memory" keeps a cache in every worker and only the worker that writes a
+# Product drops its copy, so the others can return the old one for up to
+# PRODUCT_CACHE_TTL seconds. "redis" shares one cache at PRODUCT_CACHE_URL.
+PRODUCT_CACHE_BACKEND = os.getenv("PRODUCT_CACHE_BACKEND", "none")
+PRODUCT_CACHE_URL = os.getenv("PRODUCT_CACHE_URL", "redis://localhost:6379/0")
+# Entries of the "memory" backend (a size of 0 turns it off)
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "1024"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "60"))
+
+# Opt-in request profiling: when enabled, requests with an X-Profile header
+# and a random share of PROFILE_SAMPLE_RATE are profiled, and the results are
+# written to PROFILE_DIR when it is set
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ["true", "yes", "1"]
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+
+# Statements slower than this many milliseconds are logged (negative turns it
+# off), with their plan when SLOW_QUERY_EXPLAIN is set and also appended to the
+# SLOW_QUERY_LOG file that "flask slow-queries" reads when it is set
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() in ["true", "yes", "1"]
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")
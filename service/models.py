@@ -1,5 +1,114 @@
-class Product(db.Model):
-    # ... (existing model definition remains the same)
+"""
+Models for Product Demo Service
+
+All of the models are stored in this module
+
+Models
+------
+Product - A Product used in the Product Store
+
+Attributes:
+-----------
+name (string) - the name of the product
+description (string) - the description of the product
+price (decimal) - the price of the product
+available (boolean) - True for products that are available for adoption
+category (Category) - the category the product belongs to
+
+"""
+import csv
+import io
+import logging
+import math
+import re
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from flask_sqlalchemy import SQLAlchemy
+# Imported for its full-text search functions
+from sqlalchemy.dialects import postgresql  # noqa: F401  # pylint: disable=unused-import
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import NotFound
+from service.common import metrics, replicas
+from service.common.cache import NullCache, init_app as init_cache
+from service.common.pool import InstrumentedQueuePool
+
+logger = logging.getLogger("flask.app")
+
+# Create the SQLAlchemy object to be initialized later in init_db()
+db = SQLAlchemy()
+
+
+def init_db(app):
+    """Initialize the SQLAlchemy app"""
+    Product.init_db(app)
+
+
+class DataValidationError(Exception):
+    """Used for an data validation errors when deserializing"""
+
+
+class ConcurrencyError(Exception):
+    """Used when a Product was changed by someone else since it was read"""
+
+
+class Category(Enum):
+    """Enumeration of valid Product Categories"""
+
+    UNKNOWN = 0
+    CLOTHS = 1
+    FOOD = 2
+    HOUSEWARES = 3
+    AUTOMOTIVE = 4
+    TOOLS = 5
+
+
+class Product(db.Model):  # pylint: disable=too-many-public-methods
+    """
+    Class that represents a Product
+
+    This version uses a relational database for persistence which is hidden
+    from us by SQLAlchemy's object relational mappings (ORM)
+    """
+
+    ##################################################
+    # Table Schema
+    ##################################################
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.String(250), nullable=True)
+    price = db.Column(db.Numeric, nullable=False)
+    available = db.Column(db.Boolean(), nullable=False, default=True)
+    category = db.Column(db.Enum(Category), nullable=False, server_default=Category.UNKNOWN.name)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False)
+
+    # UPDATEs only match the version that was read and bump it by one
+    __mapper_args__ = {"version_id_col": version}
+
+    # Indexes behind the filters and sort orders of Product.search()
+    __table_args__ = (
+        db.Index("ix_product_category_available_price", "category", "available", "price"),
+        db.Index("ix_product_name_id", "name", "id"),
+        db.Index("ix_product_price_id", "price", "id"),
+        # Full-text and trigram indexes behind Product.text_search(), the
+        # expression must stay the same as Product.search_document()
+        db.Index(
+            "ix_product_search",
+            db.text("to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"),
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+        db.Index(
+            "ix_product_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
+
+    # Keys a listing can be sorted by, prefixed with "-" for descending.
+    # "rank" puts the best matches of a text search first.
+    SORT_KEYS = ("id", "name", "price", "rank")
+
+    # Read-through cache for find(), chosen from the app config in init_db()
+    cache = NullCache()
 
     def serialize(self):
         """Serializes a Product into a dictionary"""
@@ -12,6 +121,16 @@ class Product(db.Model):
             "category": self.category if isinstance(self.category, str) else self.category.name
         }
 
+    def etag(self):
+        """Returns a strong entity tag that changes whenever the Product is written"""
+        return self.make_etag(self.id, self.version)
+
+    @classmethod
+    def make_etag(cls, product_id, version, fields=None):
+        """Returns the entity tag of a Product version, or of some of its fields"""
+        etag = f"{product_id}-{version}"
+        return f"{etag}-{'+'.join(fields)}" if fields else etag
+
     def deserialize(self, data):
         """
         Deserializes a Product from a dictionary
@@ -22,18 +141,20 @@ class Product(db.Model):
         try:
             self.name = data["name"]
             self.description = data.get("description")
-            self.price = float(data["price"])
+            self.price = self.parse_price(data["price"])
             self.available = data.get("available", True)
+            if not isinstance(self.available, bool):
+                raise DataValidationError(f"Invalid type for boolean [available]: {type(self.available).__name__}")
             
             # Handle category which can be string or enum
             category = data.get("category")
             if isinstance(category, str):
                 try:
-                    self.category = Category[category.upper()].name
+                    self.category = Category[category.upper()]
                 except KeyError:
                     raise DataValidationError(f"Invalid category: {category}")
             else:
-                self.category = Category(category).name
+                self.category = Category(category)
                 
         except KeyError as error:
             raise DataValidationError("Invalid product: missing " + error.args[0])
@@ -44,9 +165,12 @@ class Product(db.Model):
     def init_db(cls, app):
         """Initializes the database session"""
         logger.info("Starting database")
+        cls.cache = init_cache(app)
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        if "pool_size" in options:
+            options.setdefault("poolclass", InstrumentedQueuePool)
+        replicas.init_app(app, db)
         db.init_app(app)
-        with app.app_context():
-            db.create_all()
 
     @classmethod
     def all(cls):
@@ -55,42 +179,697 @@ class Product(db.Model):
         return cls.query.all()
 
     @classmethod
-    def find(cls, product_id):
-        """Finds a Product by its ID"""
+    def find(cls, product_id, use_cache=True):
+        """
+        Finds a Product by its ID
+
+        Column values are kept in ``cls.cache`` and merged back into the
+        session on a hit, so repeated lookups skip the database. Writers
+        pass ``use_cache=False`` to read the current version. A row read
+        from a replica may predate a write that already dropped its entry,
+        so it is only kept for as long as the replicas are allowed to lag.
+        """
         logger.info("Processing lookup for id %s ...", product_id)
-        return cls.query.get(product_id)
+        use_cache = use_cache and cls.cache.enabled
+        data = cls.cache.get(product_id) if use_cache else None
+        if use_cache:
+            metrics.cache_lookup(data is not None)
+        if data is not None:
+            product = cls(**cls.from_cache(data))
+            db.make_transient_to_detached(product)
+            return db.session.merge(product, load=False)
+        product = cls.query.get(product_id)
+        if product is not None and cls.cache.enabled:
+            cls.cache.set(product_id, product.cache_data(), ttl=replicas.lag(db.session))
+        return product
+
+    def cache_data(self):
+        """Returns the column values of the Product as JSON types any cache backend can store"""
+        data = {column.key: getattr(self, column.key) for column in self.__table__.columns}
+        data["price"] = str(data["price"])
+        data["category"] = getattr(data["category"], "name", data["category"])
+        if data["updated_at"] is not None:
+            data["updated_at"] = data["updated_at"].isoformat()
+        return data
+
+    @staticmethod
+    def from_cache(data):
+        """Turns values made by cache_data() back into column values"""
+        data = dict(data, price=Decimal(data["price"]), category=Category[data["category"]])
+        if data["updated_at"] is not None:
+            data["updated_at"] = datetime.fromisoformat(data["updated_at"])
+        return data
 
     @classmethod
     def find_by_name(cls, name):
-        """Returns all Products with the given name"""
+        """Returns a query for all Products with the given name"""
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name).all()
+        return cls.query.filter(cls.name == name)
 
     @classmethod
     def find_by_category(cls, category):
-        """Returns all Products in the given category"""
+        """Returns a query for all Products in the given category"""
         logger.info("Processing category query for %s ...", category.name)
-        return cls.query.filter(cls.category == category.name).all()
+        return cls.query.filter(cls.category == category.name)
 
     @classmethod
     def find_by_availability(cls, available=True):
-        """Returns all Products by availability"""
+        """Returns a query for all Products by availability"""
         logger.info("Processing available query for %s ...", available)
-        return cls.query.filter(cls.available == available).all()
+        return cls.query.filter(cls.available == available)
+
+    @classmethod
+    def criteria(cls, ids=None, name=None, category=None, available=None,  # pylint: disable=too-many-arguments
+                 min_price=None, max_price=None, q=None):
+        """Returns the SQL criteria matching every given filter"""
+        clauses = []
+        if ids is not None:
+            clauses.append(cls.id.in_(ids))
+        if name is not None:
+            clauses.append(cls.name == name)
+        if category is not None:
+            clauses.append(cls.category == category.name)
+        if available is not None:
+            clauses.append(cls.available == available)
+        if min_price is not None:
+            clauses.append(cls.price >= min_price)
+        if max_price is not None:
+            clauses.append(cls.price <= max_price)
+        if q is not None:
+            clauses.append(cls.text_search(q)[0])
+        return clauses
+
+    @classmethod
+    def search_document(cls):
+        """Returns the full-text document of a Product on PostgreSQL"""
+        return db.func.to_tsvector(
+            db.literal_column("'simple'"), db.func.coalesce(cls.name, "") + " " + db.func.coalesce(cls.description, "")
+        )
+
+    @classmethod
+    def text_search(cls, q):
+        """
+        Returns the match criterion and relevance rank for a search string
+
+        PostgreSQL matches every word as a prefix against the full-text index
+        and also accepts names that are similar by trigrams to catch typos.
+        Other databases (SQLite in tests) match every word with LIKE.
+        """
+        words = re.findall(r"\w+", q)
+        if not words:
+            raise DataValidationError(f"Invalid search: {q}")
+        if db.engine.dialect.name == "postgresql":
+            query = db.func.to_tsquery(db.literal_column("'simple'"), " & ".join(f"{word}:*" for word in words))
+            match = cls.search_document().op("@@")(query) | cls.name.op("%")(q)
+            rank = db.func.ts_rank(cls.search_document(), query) + db.func.similarity(cls.name, q)
+        else:
+            match = db.and_(
+                *[cls.name.icontains(word, autoescape=True) | cls.description.icontains(word, autoescape=True)
+                  for word in words]
+            )
+            rank = db.case(
+                (cls.name.istartswith(q, autoescape=True), 2),
+                (cls.name.icontains(q, autoescape=True), 1),
+                else_=0,
+            )
+        return match, rank
+
+    @classmethod
+    def sort_columns(cls, sort="id", q=None):
+        """
+        Returns the columns to order by for a sort key such as "price" or "-price"
+
+        The id always follows the sort column so the order is total, which
+        keyset pagination needs.
+        """
+        descending = sort.startswith("-")
+        key = sort.lstrip("-")
+        if key not in cls.SORT_KEYS or (key == "rank" and (q is None or descending)):
+            raise DataValidationError(f"Invalid sort: {sort}")
+        if key == "rank":
+            return [cls.text_search(q)[1], cls.id], True
+        columns = [getattr(cls, key)] if key != "id" else []
+        columns.append(cls.id)
+        return columns, descending
+
+    @classmethod
+    def search(cls, sort="id", **filters):
+        """Returns a query for the Products matching every given filter in sort order"""
+        logger.info("Processing search query for %s sorted by %s ...", filters, sort)
+        columns, descending = cls.sort_columns(sort, filters.get("q"))
+        query = cls.query.filter(*cls.criteria(**filters))
+        return query.order_by(*[column.desc() if descending else column for column in columns])
+
+    @classmethod
+    def fingerprint(cls, query):
+        """
+        Returns the row count and latest updated_at of a Product query
+
+        Both change whenever a matching Product is created, updated or
+        deleted, which makes them a cheap validator for a whole listing.
+        """
+        logger.info("Processing fingerprint query ...")
+        return query.order_by(None).with_entities(db.func.count(cls.id), db.func.max(cls.updated_at)).one()
+
+    @classmethod
+    def paginate(cls, query, limit, after=None, sort="id", q=None):  # pylint: disable=too-many-arguments
+        """
+        Returns one keyset page of a Product query made by search()
+
+        The page starts right after the ``after`` position of the previous
+        page, so the cost of a page does not depend on how deep it is.
+
+        Returns:
+            tuple: the Products on the page and the position to continue
+            after, or None when this is the last page
+        """
+        logger.info("Processing page of %s after %s ...", limit, after)
+        columns, descending = cls.sort_columns(sort, q)
+        if after is not None:
+            try:
+                values = [cls.cursor_value(column, after["key"]) for column in columns[:-1]]
+                values.append(cls.cursor_value(cls.id, after["id"]))
+            except (KeyError, TypeError, ValueError, ArithmeticError) as error:
+                raise DataValidationError(f"Invalid page position: {after}") from error
+            if after.get("sort", "id") != sort:
+                raise DataValidationError(f"Page position is not sorted by {sort}")
+            position = db.tuple_(*columns) if len(columns) > 1 else columns[0]
+            bound = tuple(values) if len(values) > 1 else values[0]
+            query = query.filter(position < bound if descending else position > bound)
+        products = query.limit(limit + 1).all()
+        if len(products) <= limit:
+            return products, None
+        last = products[limit - 1]
+        position = {"sort": sort, "id": last.id}
+        if sort == "rank":
+            position["key"] = db.session.query(columns[0]).filter(cls.id == last.id).scalar()
+        elif len(columns) > 1:
+            value = getattr(last, columns[0].key)
+            position["key"] = str(value) if columns[0] is cls.price else value
+        return products[:limit], position
+
+    @classmethod
+    def cursor_value(cls, column, value):
+        """
+        Returns a value of a page position checked against its sort column
+
+        Positions come back from clients, so anything but a scalar of the
+        column's type raises TypeError instead of reaching the database.
+        """
+        if column is cls.id:
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise TypeError(f"id must be an integer, not {type(value).__name__}")
+            return value
+        if column is cls.name:
+            if not isinstance(value, str):
+                raise TypeError(f"name must be a string, not {type(value).__name__}")
+            return value
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise TypeError(f"key must be a number, not {type(value).__name__}")
+        return Decimal(str(value)) if column is cls.price else float(value)
+
+    @classmethod
+    def find_many(cls, query, ids, chunk_size=500):
+        """
+        Returns the rows of a Product query whose id is in a list, keyed by id
+
+        Long lists are looked up in chunks so a statement never carries
+        more than ``chunk_size`` ids.
+        """
+        logger.info("Processing lookup for %s ids ...", len(ids))
+        found = {}
+        for start in range(0, len(ids), chunk_size):
+            for row in query.filter(cls.id.in_(ids[start:start + chunk_size])):
+                found[row.id] = row
+        return found
+
+    @classmethod
+    def stream(cls, query, batch_size=1000):
+        """
+        Returns an iterator over a Product query that fetches rows in batches
+
+        ``yield_per`` reads through a server-side cursor where the driver
+        supports it, so memory stays flat no matter how many rows match.
+        """
+        logger.info("Processing streamed query in batches of %s ...", batch_size)
+        return query.yield_per(batch_size)
 
     def create(self):
         """Creates a Product to the database"""
         logger.info("Creating %s", self.name)
         db.session.add(self)
         db.session.commit()
+        self.cache.delete(self.id)
+
+    @classmethod
+    def bulk_create(cls, products, chunk_size=1000):
+        """
+        Creates many Products in a single transaction
+
+        Each chunk is flushed as one multi-row INSERT ... RETURNING id and
+        then detached from the session so the identity map stays small.
+        """
+        logger.info("Creating %s Products in chunks of %s", len(products), chunk_size)
+        try:
+            for start in range(0, len(products), chunk_size):
+                chunk = products[start:start + chunk_size]
+                db.session.add_all(chunk)
+                db.session.flush()
+                for product in chunk:
+                    db.session.expunge(product)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def copy_rows(cls, rows):
+        """
+        Inserts already validated column values as fast as the database allows
+
+        PostgreSQL streams them through COPY FROM STDIN and other databases
+        get one executemany INSERT. This runs in the current transaction and
+        skips the ORM, so callers apply the rows to ProductStats themselves.
+
+        Args:
+            rows (list): dicts of name, description, price, available and category
+        """
+        logger.info("Copying %s Products", len(rows))
+        now = datetime.utcnow()
+        columns = ("name", "description", "price", "available", "category", "version", "updated_at")
+        if db.engine.dialect.name == "postgresql":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow([row["name"], row["description"], row["price"], row["available"], row["category"], 1, now])
+            buffer.seek(0)
+            cursor = db.session.connection().connection.cursor()
+            cursor.copy_expert(f"COPY {cls.__table__.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            db.session.execute(cls.__table__.insert(), [dict(row, version=1, updated_at=now) for row in rows])
+
+    @classmethod
+    def bulk_update(cls, criteria, changes):
+        """
+        Applies changes to every Product matching the criteria
+
+        Runs as a single UPDATE statement and returns the number of rows
+        that were changed.
+        """
+        values = {key: cls.coerce_field(key, value) for key, value in changes.items()}
+        if not values:
+            raise DataValidationError("Invalid product: no fields to update")
+        values["version"] = cls.version + 1
+        logger.info("Bulk updating Products with %s", values)
+        query = cls.query.filter(*criteria)
+        groups = []
+        if {"price", "available", "category"} & set(values):
+            # Lock the rows and total up the values the stats have to move away from
+            groups = db.session.execute(cls.price_totals(cls.locked_rows(criteria))).all()
+        count = query.update(values, synchronize_session=False)
+        if count and groups and count == sum(group.rows for group in groups):
+            changes = []
+            for group in groups:
+                changes.append((group.category, -1, group.available) + tuple(group[2:]))
+                price_sum, price_min, price_max = group.price_sum, group.price_min, group.price_max
+                if "price" in values:
+                    price_sum = Decimal(str(values["price"])) * group.rows
+                    price_min = price_max = values["price"]
+                changes.append((values.get("category", group.category), 1, values.get("available", group.available),
+                                group.rows, price_sum, price_min, price_max))
+            ProductStats.apply_totals(db.session.connection(), changes)
+        elif count and groups:
+            # Rows matching the criteria were added since they were read
+            ProductStats.recompute(db.session.connection())
+        db.session.commit()
+        cls.cache.clear()
+        return count
+
+    @staticmethod
+    def coerce_field(key, value):
+        """Returns the column value of one field of a bulk update, checked like deserialize() does"""
+        try:
+            if key in ("name", "description"):
+                if not isinstance(value, str) and not (key == "description" and value is None):
+                    raise DataValidationError(f"Invalid type for string [{key}]: {type(value).__name__}")
+                return value
+            if key == "price":
+                return Product.parse_price(value)
+            if key == "available":
+                if not isinstance(value, bool):
+                    raise DataValidationError(f"Invalid type for boolean [available]: {type(value)}")
+                return value
+            if key == "category":
+                return Category[str(value).upper()].name
+        except KeyError as error:
+            raise DataValidationError(f"Invalid category: {value}") from error
+        except (TypeError, ValueError) as error:
+            raise DataValidationError("Invalid product: " + str(error)) from error
+        raise DataValidationError(f"Invalid product: unknown field {key}")
+
+    @staticmethod
+    def parse_price(value):
+        """Returns a price as a float, raising ValueError unless it is a finite number"""
+        if isinstance(value, bool):
+            raise ValueError(f"Invalid type for price: {type(value).__name__}")
+        price = float(value)
+        if not math.isfinite(price):
+            raise ValueError(f"Invalid price: {value}")
+        return price
+
+    @classmethod
+    def bulk_delete(cls, criteria):
+        """Removes every Product matching the criteria with a single DELETE statement"""
+        logger.info("Bulk deleting Products")
+        count = cls.delete_rows(criteria)
+        db.session.commit()
+        cls.cache.clear()
+        return count
+
+    @classmethod
+    def delete_by_id(cls, product_id):
+        """
+        Removes a Product by its id without loading it first
+
+        Returns True when a row was deleted and False when none matched.
+        """
+        logger.info("Deleting Product with id %s", product_id)
+        deleted = cls.delete_rows([cls.id == product_id]) > 0
+        db.session.commit()
+        cls.cache.delete(product_id)
+        return deleted
+
+    @classmethod
+    def delete_rows(cls, criteria):
+        """
+        Deletes the Products matching the criteria and returns how many rows it removed
+
+        The category stats move by the count and price totals of the rows,
+        grouped by category and availability in the database so only one
+        row per group is read. PostgreSQL groups the rows the DELETE
+        returns in the same statement. Other databases total the locked
+        rows first and rebuild the stats if the DELETE removed others too.
+        """
+        if db.engine.dialect.name == "postgresql":
+            table = cls.__table__
+            deleted = table.delete().where(*criteria).returning(table.c.category, table.c.available, table.c.price)
+            deleted = deleted.cte("deleted")
+            groups = db.session.execute(cls.price_totals(deleted)).all()
+            count = sum(group.rows for group in groups)
+        else:
+            groups = db.session.execute(cls.price_totals(cls.locked_rows(criteria))).all()
+            count = db.session.execute(db.delete(cls).where(*criteria)).rowcount
+            if count != sum(group.rows for group in groups):
+                ProductStats.recompute(db.session.connection())
+                return count
+        ProductStats.apply_totals(
+            db.session.connection(), [(group.category, -1, group.available) + tuple(group[2:]) for group in groups]
+        )
+        return count
+
+    @classmethod
+    def locked_rows(cls, criteria):
+        """Returns the category, availability and price of the Products matching the criteria, locked for update"""
+        return db.select(cls.category, cls.available, cls.price).where(*criteria).with_for_update().subquery("locked")
+
+    @staticmethod
+    def price_totals(rows):
+        """Returns a SELECT of the count and price totals of rows for each category and availability"""
+        return db.select(
+            rows.c.category,
+            rows.c.available,
+            db.func.count().label("rows"),
+            db.func.sum(rows.c.price).label("price_sum"),
+            db.func.min(rows.c.price).label("price_min"),
+            db.func.max(rows.c.price).label("price_max"),
+        ).group_by(rows.c.category, rows.c.available)
 
     def update(self):
         """Updates a Product to the database"""
         logger.info("Updating %s", self.name)
-        db.session.commit()
+        self.check_persisted()
+        product_id = self.id
+        try:
+            if not db.engine.dialect.supports_sane_rowcount_returning:
+                self.claim_version()
+            db.session.commit()
+        except StaleDataError as error:
+            db.session.rollback()
+            raise ConcurrencyError(f"Product with id '{product_id}' was changed by another request") from error
+        finally:
+            self.cache.delete(product_id)
+
+    def check_persisted(self):
+        """Raises NotFound unless the Product was read from or written to the database"""
+        if not db.inspect(self).persistent:
+            raise NotFound(f"Product with id '{self.id}' was not found.")
+
+    def claim_version(self):
+        """
+        Checks that the row still has the version that was read, in the current transaction
+
+        The ORM checks the version with UPDATE ... RETURNING and can only
+        trust the row count where the driver reports it for RETURNING,
+        which pysqlite does not. This claims the row with a plain UPDATE
+        first so the check holds on every database.
+        """
+        table = self.__table__
+        statement = table.update().where(table.c.id == self.id, table.c.version == self.version)
+        # Setting updated_at to itself keeps its onupdate default from moving it
+        statement = statement.values(version=table.c.version, updated_at=table.c.updated_at)
+        if db.session.connection().execute(statement).rowcount != 1:
+            raise StaleDataError(f"Product with id '{self.id}' is no longer at version {self.version}")
 
     def delete(self):
         """Removes a Product from the database"""
         logger.info("Deleting %s", self.name)
+        self.check_persisted()
+        product_id = self.id
         db.session.delete(self)
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+        self.cache.delete(product_id)
+
+
+######################################################################
+# The trigram index needs the pg_trgm extension on PostgreSQL
+######################################################################
+db.event.listen(
+    Product.__table__,
+    "before_create",
+    db.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
+######################################################################
+# Columns added to the product table after it was first created, with
+# the value that rows written before the upgrade get
+######################################################################
+ADDED_COLUMNS = {
+    "updated_at": datetime.utcnow,
+    "version": lambda: 1,
+}
+
+
+def add_missing_columns(connection):
+    """
+    Adds the columns of ADDED_COLUMNS that the product table lacks
+
+    create_all() never alters a table that exists, so an older table is
+    brought up to date here: each column is added, filled in for the rows
+    already there and then made NOT NULL where the database can do that.
+    Returns the names of the columns that were added.
+    """
+    table = Product.__table__
+    existing = {column["name"] for column in db.inspect(connection).get_columns(table.name)}
+    added = []
+    for name, backfill in ADDED_COLUMNS.items():
+        if name in existing:
+            continue
+        logger.info("Adding column %s.%s", table.name, name)
+        kind = table.c[name].type.compile(dialect=connection.dialect)
+        connection.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {name} {kind}"))
+        value = db.bindparam("value", backfill(), type_=table.c[name].type)
+        connection.execute(db.text(f"UPDATE {table.name} SET {name} = :value").bindparams(value))
+        if connection.dialect.name == "postgresql":
+            connection.execute(db.text(f"ALTER TABLE {table.name} ALTER COLUMN {name} SET NOT NULL"))
+        added.append(name)
+    return added
+
+
+class ProductStats(db.Model):
+    """
+    Running totals of the Products in each category
+
+    The totals are changed in the same transaction as every Product write,
+    so reading them costs one row per category instead of a table scan.
+    Every category has a row, even when it has no Products.
+    """
+
+    __tablename__ = "product_stats"
+
+    category = db.Column(db.String(63), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    available = db.Column(db.Integer, nullable=False, default=0)
+    price_sum = db.Column(db.Numeric, nullable=False, default=0)
+    price_min = db.Column(db.Numeric, nullable=True)
+    price_max = db.Column(db.Numeric, nullable=True)
+
+    def serialize(self):
+        """Serializes the stats of a category into a dictionary"""
+        return {
+            "category": self.category,
+            "count": self.count,
+            "available": self.available,
+            "availability_ratio": self.available / self.count if self.count else None,
+            "min_price": self.price_min,
+            "avg_price": self.price_sum / self.count if self.count else None,
+            "max_price": self.price_max,
+        }
+
+    @classmethod
+    def all(cls):
+        """Returns the stats of every category"""
+        logger.info("Processing all Product stats")
+        return cls.query.order_by(cls.category).all()
+
+    @classmethod
+    def apply(cls, connection, changes):
+        """
+        Adds Product changes to the stats of their categories
+
+        Args:
+            connection: the connection of the transaction making the changes
+            changes (list): (category, +1 or -1, available, price) tuples
+        """
+        cls.apply_totals(connection, [(category, sign, available, 1, price, price, price)
+                                      for category, sign, available, price in changes])
+
+    @classmethod
+    def apply_totals(cls, connection, changes):  # pylint: disable=too-many-locals
+        """
+        Adds groups of Product changes to the stats of their categories
+
+        Args:
+            connection: the connection of the transaction making the changes
+            changes (list): (category, +1 or -1, available, count, price sum,
+                lowest price, highest price) tuples for groups of Products
+        """
+        totals = {}
+        for category, sign, available, count, price_sum, price_min, price_max in changes:
+            category = category.name if isinstance(category, Category) else category
+            total = totals.setdefault(category, {"count": 0, "available": 0, "sum": 0, "added": [], "removed": []})
+            total["count"] += sign * count
+            total["available"] += sign * count if available else 0
+            total["sum"] += sign * Decimal(str(price_sum))
+            total["added" if sign > 0 else "removed"] += [Decimal(str(price_min)), Decimal(str(price_max))]
+
+        for category, total in totals.items():
+            lowest = cls.price_min
+            highest = cls.price_max
+            if total["added"]:
+                low, high = min(total["added"]), max(total["added"])
+                lowest = db.case((db.or_(cls.price_min.is_(None), cls.price_min > low), low), else_=cls.price_min)
+                highest = db.case((db.or_(cls.price_max.is_(None), cls.price_max < high), high), else_=cls.price_max)
+            if total["removed"]:
+                # Only look at the products again when an extreme was removed
+                prices = db.select(db.func.min(Product.price), db.func.max(Product.price))
+                prices = prices.where(Product.category == category)
+                lowest = db.case(
+                    (cls.price_min >= min(total["removed"]), prices.with_only_columns(db.func.min(Product.price))
+                     .scalar_subquery()),
+                    else_=lowest,
+                )
+                highest = db.case(
+                    (cls.price_max <= max(total["removed"]), prices.with_only_columns(db.func.max(Product.price))
+                     .scalar_subquery()),
+                    else_=highest,
+                )
+            connection.execute(
+                db.update(cls)
+                .where(cls.category == category)
+                .values(
+                    count=cls.count + total["count"],
+                    available=cls.available + total["available"],
+                    price_sum=cls.price_sum + total["sum"],
+                    price_min=lowest,
+                    price_max=highest,
+                )
+            )
+
+    @classmethod
+    def recompute(cls, connection):
+        """Rebuilds the stats of every category from the Product table"""
+        logger.info("Recomputing Product stats")
+        rows = connection.execute(
+            db.select(
+                Product.category,
+                db.func.count(Product.id),
+                db.func.sum(db.case((Product.available, 1), else_=0)),
+                db.func.sum(Product.price),
+                db.func.min(Product.price),
+                db.func.max(Product.price),
+            ).group_by(Product.category)
+        ).all()
+        found = {(row[0].name if isinstance(row[0], Category) else row[0]): row[1:] for row in rows}
+        connection.execute(db.delete(cls))
+        connection.execute(
+            db.insert(cls),
+            [
+                dict(zip(("category", "count", "available", "price_sum", "price_min", "price_max"),
+                         (category.name,) + tuple(found.get(category.name, (0, 0, 0, None, None)))))
+                for category in Category
+            ],
+        )
+
+
+@db.event.listens_for(db.session, "after_flush")
+def record_product_stats(session, flush_context):  # pylint: disable=unused-argument
+    """Applies the Products inserted, updated or deleted by a flush to the stats"""
+    changes = list(_stats_changes(session))
+    if None in changes:
+        ProductStats.recompute(session.connection())
+    elif changes:
+        ProductStats.apply(session.connection(), changes)
+
+
+def _stats_changes(session):
+    """Yields the stats changes of a flush, or None for a Product whose old values were not loaded"""
+    for product in session.new:
+        if isinstance(product, Product):
+            yield (product.category, 1, product.available, product.price)
+    for product in session.deleted:
+        if isinstance(product, Product):
+            yield _removed_stats(product)
+    for product in session.dirty:
+        if isinstance(product, Product) and product not in session.deleted:
+            state = db.inspect(product)
+            if any(state.attrs[key].history.has_changes() for key in ("category", "available", "price")):
+                yield _removed_stats(product)
+                yield (product.category, 1, product.available, product.price)
+
+
+def _removed_stats(product):
+    """Returns the stats change taking away the values a Product had in the database"""
+    old = [_committed_value(product, key) for key in ("category", "available", "price")]
+    if any(value is _UNKNOWN for value in old):
+        return None
+    return (old[0], -1, old[1], old[2])
+
+
+_UNKNOWN = object()
+
+
+def _committed_value(product, key):
+    """Returns the value an attribute had in the database before this flush"""
+    history = db.inspect(product).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return _UNKNOWN
+
+
+@db.event.listens_for(ProductStats.__table__, "after_create")
+def seed_product_stats(target, connection, **kw):  # pylint: disable=unused-argument
+    """Gives every category an empty stats row when the table is created"""
+    ProductStats.recompute(connection)
@@ -1,10 +1,22 @@
-from flask import request, jsonify, abort
-from service import app
-from service.models import Product, Category, DataValidationError
-from service.common import status
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from datetime import timezone
+from hashlib import sha1
+from time import perf_counter
+from werkzeug.http import http_date, quote_etag
+from flask import Blueprint, request, jsonify, abort, url_for, Response, stream_with_context
+from flask import current_app as app
+from service import serializers
+from service.models import db, Product, ProductStats, Category, DataValidationError
+from service.common import metrics, pool, status
 from urllib.parse import quote_plus
 
-@app.route("/products", methods=["POST"])
+NDJSON = "application/x-ndjson"
+
+api = Blueprint("api", __name__)
+
+@api.route("/products", methods=["POST"])
 def create_products():
     """
     Creates a Product
@@ -23,34 +35,154 @@ def create_products():
     app.logger.info("Product with ID [%s] created.", product.id)
     return jsonify(product.serialize()), status.HTTP_201_CREATED
 
-@app.route("/products/<int:product_id>", methods=["GET"])
+@api.route("/products/batch", methods=["POST"])
+def create_products_batch():
+    """
+    Creates many Products at once
+    This endpoint takes a JSON array (or NDJSON body) of Products, validates
+    every item and inserts the valid ones in a single transaction
+    """
+    app.logger.info("Request to create a batch of products")
+    products = []
+    results = []
+    for index, item in enumerate(read_batch_items()):
+        try:
+            product = build_product(item)
+        except DataValidationError as error:
+            results.append({"index": index, "status": status.HTTP_400_BAD_REQUEST, "error": str(error)})
+            continue
+        products.append(product)
+        results.append({"index": index, "status": status.HTTP_201_CREATED, "product": product})
+    
+    Product.bulk_create(products, app.config["BULK_CHUNK_SIZE"])
+    for result in results:
+        if "product" in result:
+            result["product"] = result["product"].serialize()
+    
+    errors = len(results) - len(products)
+    app.logger.info("[%s] Products created, [%s] rejected", len(products), errors)
+    return jsonify(results), status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+
+def read_batch_items():
+    """
+    Returns the items of a batch body, a JSON array or NDJSON lines
+    
+    An NDJSON line that is not valid JSON becomes a DataValidationError so
+    it is reported with its index instead of failing the whole batch
+    """
+    if request.headers.get("Content-Type") != NDJSON:
+        check_content_type("application/json")
+        items = request.get_json()
+        if not isinstance(items, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be an array of products")
+        return items
+    items = []
+    for line in request.get_data(as_text=True).splitlines():
+        if line.strip():
+            try:
+                items.append(json.loads(line))
+            except ValueError as error:
+                items.append(DataValidationError(f"Invalid JSON: {error}"))
+    return items
+
+def build_product(item):
+    """Returns a new Product made from one batch item or raises DataValidationError"""
+    if isinstance(item, DataValidationError):
+        raise item
+    if not isinstance(item, dict):
+        raise DataValidationError("Invalid product: body must be an object")
+    product = Product()
+    product.deserialize(item)
+    return product
+
+@api.route("/products/batch", methods=["PATCH"])
+def update_products_batch():
+    """
+    Updates many Products at once
+    This endpoint applies the "set" changes to every Product matching the
+    "filter" (ids, name, category, available, min_price, max_price) with
+    one UPDATE statement
+    """
+    app.logger.info("Request to update a batch of products")
+    check_content_type("application/json")
+    body = request.get_json()
+    if not isinstance(body, dict) or not isinstance(body.get("set"), dict):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must have a 'set' object")
+    
+    criteria = get_criteria(body.get("filter") or {})
+    count = Product.bulk_update(criteria, body["set"])
+    app.logger.info("[%s] Products updated", count)
+    return jsonify(updated=count), status.HTTP_200_OK
+
+@api.route("/products/stats", methods=["GET"])
+def get_product_stats():
+    """
+    Retrieve the Product stats
+    This endpoint will return the count, availability and prices of the
+    Products in each category from the running totals
+    """
+    app.logger.info("Request to get product stats")
+    results = [stats.serialize() for stats in ProductStats.all()]
+    return jsonify(results), status.HTTP_200_OK
+
+@api.route("/products/<int:product_id>", methods=["GET"])
 def get_products(product_id):
     """
     Retrieve a single Product
-    This endpoint will return a Product based on its id
+    This endpoint will return a Product based on its id, or only the
+    comma separated ``fields`` asked for
     """
     app.logger.info("Request to get product with id: %s", product_id)
     
+    fields = serializers.parse_fields(request.args.get("fields"))
+    if fields != serializers.FIELDS:
+        return get_product_fields(product_id, fields)
+    
     product = Product.find(product_id)
     if not product:
         abort(status.HTTP_404_NOT_FOUND, f"Product with id '{product_id}' was not found.")
     
+    headers = validator_headers(product.etag(), product.updated_at)
+    if not_modified(product.etag(), product.updated_at):
+        app.logger.info("Product with ID [%s] not modified.", product_id)
+        return "", status.HTTP_304_NOT_MODIFIED, headers
+    
     app.logger.info("Returning product: %s", product.name)
-    return jsonify(product.serialize()), status.HTTP_200_OK
+    return jsonify(product.serialize()), status.HTTP_200_OK, headers
+
+def get_product_fields(product_id, fields):
+    """Returns only the given fields of a Product, reading only those columns"""
+    query = Product.query.filter(Product.id == product_id)
+    row = serializers.project(query, fields, ("id", "version", "updated_at")).first()
+    if not row:
+        abort(status.HTTP_404_NOT_FOUND, f"Product with id '{product_id}' was not found.")
+    
+    etag = Product.make_etag(row.id, row.version, fields)
+    headers = validator_headers(etag, row.updated_at)
+    if not_modified(etag, row.updated_at):
+        app.logger.info("Product with ID [%s] not modified.", product_id)
+        return "", status.HTTP_304_NOT_MODIFIED, headers
+    
+    app.logger.info("Returning fields %s of product: %s", fields, product_id)
+    return jsonify(serializers.serialize_row(row, fields)), status.HTTP_200_OK, headers
 
-@app.route("/products/<int:product_id>", methods=["PUT"])
+@api.route("/products/<int:product_id>", methods=["PUT"])
 def update_products(product_id):
     """
     Update a Product
-    This endpoint will update a Product based on the body that is posted
+    This endpoint will update a Product based on the body that is posted.
+    An If-Match header makes the update conditional on the Product's ETag
     """
     app.logger.info("Request to update product with id: %s", product_id)
     check_content_type("application/json")
     
-    product = Product.find(product_id)
+    product = Product.find(product_id, use_cache=False)
     if not product:
         abort(status.HTTP_404_NOT_FOUND, f"Product with id '{product_id}' was not found.")
     
+    if request.if_match and not request.if_match.contains(product.etag()):
+        abort(status.HTTP_412_PRECONDITION_FAILED, f"Product with id '{product_id}' does not match If-Match.")
+    
     try:
         product.deserialize(request.get_json())
     except DataValidationError as error:
@@ -58,9 +190,9 @@ def update_products(product_id):
     
     product.update()
     app.logger.info("Product with ID [%s] updated.", product.id)
-    return jsonify(product.serialize()), status.HTTP_200_OK
+    return jsonify(product.serialize()), status.HTTP_200_OK, validator_headers(product.etag(), product.updated_at)
 
-@app.route("/products/<int:product_id>", methods=["DELETE"])
+@api.route("/products/<int:product_id>", methods=["DELETE"])
 def delete_products(product_id):
     """
     Delete a Product
@@ -68,44 +200,146 @@ def delete_products(product_id):
     """
     app.logger.info("Request to delete product with id: %s", product_id)
     
-    product = Product.find(product_id)
-    if product:
-        product.delete()
+    Product.delete_by_id(product_id)
     
     app.logger.info("Product with ID [%s] delete complete.", product_id)
     return "", status.HTTP_204_NO_CONTENT
 
-@app.route("/products", methods=["GET"])
+@api.route("/products", methods=["DELETE"])
+def delete_products_batch():
+    """
+    Delete many Products
+    This endpoint deletes every Product matching the query string filters
+    (name, category, available, min_price, max_price, ids) or the "ids" in
+    a JSON body
+    """
+    app.logger.info("Request to delete a batch of products")
+    filters = request.args.to_dict()
+    if request.content_length:
+        check_content_type("application/json")
+        body = request.get_json()
+        if not isinstance(body, dict):
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be an object")
+        filters.update(body)
+    
+    count = Product.bulk_delete(get_criteria(filters))
+    app.logger.info("[%s] Products deleted", count)
+    return jsonify(deleted=count), status.HTTP_200_OK
+
+@api.route("/products", methods=["GET"])
 def list_products():
-    """Returns a list of Products with optional filtering"""
+    """
+    Returns a list of Products with optional filtering
+
+    Any mix of name, category, available, min_price and max_price filters is
+    combined, and ``sort`` orders the rows by id, name or price ("-price"
+    for descending). ``q`` searches the name and description and returns
+    the best matches first. Passing ``limit`` (and the ``cursor`` from a
+    previous response) returns one keyset page at a time with a
+    ``Link: <...>; rel="next"`` header. ``fields`` limits the columns read
+    and returned to a comma separated list. ``ids=1,2,3`` looks the ids up
+    at once and answers with the "products" found in that order and the
+    ids that are "missing". Sending ``Accept: application/x-ndjson`` or ``?stream=true`` streams the
+    rows one by one instead of building the whole list in memory
+    """
     app.logger.info("Request to list products")
     
-    products = []
-    name = request.args.get("name")
-    category = request.args.get("category")
-    available = request.args.get("available")
-    
-    if name:
-        app.logger.info("Filtering by name: %s", name)
-        products = Product.find_by_name(name)
-    elif category:
-        app.logger.info("Filtering by category: %s", category)
-        try:
-            # Convert string category to enum value
-            category_enum = Category[category.upper()]
-            products = Product.find_by_category(category_enum)
-        except KeyError:
-            abort(status.HTTP_400_BAD_REQUEST, f"Invalid category: {category}")
-    elif available is not None:
-        app.logger.info("Filtering by availability: %s", available)
-        available_bool = available.lower() in ["true", "yes", "1"]
-        products = Product.find_by_availability(available_bool)
-    else:
-        app.logger.info("Returning all products")
-        products = Product.all()
-    
-    results = [product.serialize() for product in products]
+    filters = get_filters(request.args)
+    ids = filters.pop("ids", None)
+    sort = request.args.get("sort", "rank" if "q" in filters else "id")
+    app.logger.info("Filtering by %s sorted by %s", filters, sort)
+    products = Product.search(sort, **filters)
+    fields = serializers.parse_fields(request.args.get("fields"))
+    if ids is not None:
+        return list_products_by_ids(products, ids, fields)
+    
+    paged = "limit" in request.args or "cursor" in request.args
+    ndjson = request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+    stream = ndjson or request.args.get("stream", "").lower() in ["true", "yes", "1"]
+    
+    # Pages and streams skip the count behind the list ETag, which would
+    # read every matching row again. Lists get no Last-Modified because a
+    # delete does not move the newest updated_at.
+    headers = {}
+    if not (paged or stream):
+        etag = list_etag(products)
+        headers = validator_headers(etag, None)
+        if not_modified(etag, None):
+            app.logger.info("Product list not modified.")
+            return "", status.HTTP_304_NOT_MODIFIED, headers
+    
+    sort_key = sort.lstrip("-")
+    products = serializers.project(products, fields, ("id", sort_key) if sort_key in serializers.FIELDS else ("id",))
+    if paged:
+        products = paginate_products(products, sort, filters.get("q"), headers)
+    
+    if stream:
+        app.logger.info("Streaming products as %s", NDJSON if ndjson else "a JSON array")
+        if not isinstance(products, list):
+            products = Product.stream(products, app.config["STREAM_BATCH_SIZE"])
+        rows = generate_ndjson(products, fields) if ndjson else generate_json_array(products, fields)
+        return Response(
+            stream_with_context(rows),
+            status=status.HTTP_200_OK,
+            headers=headers,
+            mimetype=NDJSON if ndjson else "application/json",
+        )
+    
+    products = list(products)
+    with metrics.serialization():
+        results = [serializers.serialize_row(row, fields) for row in products]
+        body = serializers.dumps(results) + b"\n"
+    metrics.products_returned(len(results))
     app.logger.info("[%s] Products returned", len(results))
+    return Response(body, status.HTTP_200_OK, headers, mimetype="application/json")
+
+def paginate_products(products, sort, q, headers):
+    """Returns the page of products after the request's cursor and adds the Link to the next page to headers"""
+    after = decode_cursor(request.args.get("cursor"))
+    products, position = Product.paginate(products, get_page_limit(), after, sort, q)
+    if position is not None:
+        headers["Link"] = f'<{next_page_url(encode_cursor(position))}>; rel="next"'
+    return products
+
+def list_products_by_ids(products, ids, fields):
+    """
+    Returns the Products of a query with the given ids in that order
+
+    The ids are only matched chunk by chunk in Product.find_many, and the
+    ETag is made from the versions found, so no query reads past them.
+    """
+    found = Product.find_many(serializers.project(products.order_by(None), fields, ("id", "version")), ids)
+    versions = [f"{product_id}-{found[product_id].version}" for product_id in ids if product_id in found]
+    etag = sha1(f"{','.join(versions)}:{request.full_path}:{request.accept_mimetypes}".encode("utf-8")).hexdigest()
+    headers = validator_headers(etag, None)
+    if not_modified(etag, None):
+        app.logger.info("Product list not modified.")
+        return "", status.HTTP_304_NOT_MODIFIED, headers
+    
+    with metrics.serialization():
+        results = [serializers.serialize_row(found[product_id], fields) for product_id in ids if product_id in found]
+        missing = [product_id for product_id in ids if product_id not in found]
+        body = jsonify(products=results, missing=missing)
+    metrics.products_returned(len(results))
+    app.logger.info("[%s] Products returned, [%s] missing", len(results), len(missing))
+    return body, status.HTTP_200_OK, headers
+
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Returns the service metrics in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return Response(body, status.HTTP_200_OK, {"Content-Type": content_type})
+
+@api.route("/metrics/pool", methods=["GET"])
+def get_pool_stats():
+    """
+    Retrieve the database connection pool stats
+    This endpoint will return the size, connections in use and checkout
+    waits of the pools of the worker that serves the request
+    """
+    results = pool.stats(db.engine.pool)
+    if "replicas" in app.extensions:
+        results["replicas"] = app.extensions["replicas"].stats()
     return jsonify(results), status.HTTP_200_OK
 
 def check_content_type(content_type):
@@ -116,4 +350,143 @@ def check_content_type(content_type):
     
     if request.headers["Content-Type"] != content_type:
         app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
-        abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Content-Type must be {}".format(content_type))
\ No newline at end of file
+        abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, "Content-Type must be {}".format(content_type))
+
+def validator_headers(etag, last_modified):
+    """Returns the ETag and Last-Modified headers for a response"""
+    headers = {"ETag": quote_etag(etag)}
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified.replace(tzinfo=timezone.utc))
+    return headers
+
+def not_modified(etag, last_modified):
+    """Checks If-None-Match (with the weak comparison of RFC 7232) and If-Modified-Since against the current validators"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= request.if_modified_since
+    return False
+
+def list_etag(products):
+    """Returns an entity tag for a list that changes whenever a matching Product is added, written or deleted"""
+    count, last_modified = Product.fingerprint(products)
+    return sha1(f"{count}:{last_modified}:{request.full_path}:{request.accept_mimetypes}".encode("utf-8")).hexdigest()
+
+def get_filters(source):
+    """Parses the product filters out of query arguments or a JSON object"""
+    filters = {key: source[key] for key in ("name", "q") if source.get(key)}
+    if source.get("ids") is not None:
+        filters["ids"] = get_ids(source["ids"])
+    if source.get("category"):
+        filters["category"] = get_category(source["category"])
+    if source.get("available") is not None:
+        filters["available"] = get_flag(source["available"])
+    for key in ("min_price", "max_price"):
+        if source.get(key) is not None:
+            filters[key] = get_price(key, source[key])
+    return filters
+
+def get_category(category):
+    """Parses a Category by its name in any case"""
+    try:
+        found = Category[str(category).upper()]
+    except KeyError:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid category: {category}")
+    return found
+
+def get_flag(value):
+    """Parses a boolean that query arguments spell as true, yes or 1"""
+    if isinstance(value, str):
+        return value.lower() in ["true", "yes", "1"]
+    return value
+
+def get_price(key, value):
+    """Parses a price bound as a number"""
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid {key}: {value}")
+    return price
+
+def get_ids(ids):
+    """Parses a comma separated string or a list of ids without repeats, capped to MAX_IDS"""
+    if isinstance(ids, str):
+        ids = ids.split(",")
+    try:
+        ids = list(dict.fromkeys(int(product_id) for product_id in ids))
+    except (TypeError, ValueError):
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid ids: {ids}")
+    if len(ids) > app.config["MAX_IDS"]:
+        abort(status.HTTP_400_BAD_REQUEST, f"Too many ids: {len(ids)}, at most {app.config['MAX_IDS']} are allowed")
+    return ids
+
+def get_criteria(filters):
+    """Turns a dictionary of product filters into Product criteria"""
+    unknown = set(filters) - {"ids", "name", "category", "available", "min_price", "max_price"}
+    if unknown:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid filter: {', '.join(sorted(unknown))}")
+    if not filters:
+        abort(status.HTTP_400_BAD_REQUEST, "At least one filter is required")
+    return Product.criteria(**get_filters(filters))
+
+def get_page_limit():
+    """Returns the page size requested with ?limit= capped to MAX_PAGE_SIZE"""
+    max_size = app.config["MAX_PAGE_SIZE"]
+    limit = request.args.get("limit", str(max_size))
+    if not limit.isdigit() or int(limit) < 1:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid limit: {limit}")
+    return min(int(limit), max_size)
+
+def encode_cursor(position):
+    """Encodes a keyset position as an opaque cursor string"""
+    data = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """Decodes a cursor made by encode_cursor back into a keyset position"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(urlsafe_b64decode(padded.encode("ascii")))
+    except (Base64Error, UnicodeError, ValueError):
+        position = None
+    if not isinstance(position, dict):
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid cursor: {cursor}")
+    return position
+
+def next_page_url(cursor):
+    """Returns the url of the next page keeping the current query arguments"""
+    args = request.args.to_dict()
+    args["cursor"] = cursor
+    return url_for(".list_products", _external=True, **args)
+
+def generate_ndjson(rows, fields):
+    """Yields the fields of each Product row as one line of newline delimited JSON"""
+    count = 0
+    elapsed = 0.0
+    for row in rows:
+        count += 1
+        started = perf_counter()
+        line = serializers.dumps(serializers.serialize_row(row, fields)) + b"\n"
+        elapsed += perf_counter() - started
+        yield line
+    metrics.SERIALIZATION_SECONDS.labels(metrics.route()).observe(elapsed)
+    metrics.products_returned(count)
+    app.logger.info("[%s] Products streamed", count)
+
+def generate_json_array(rows, fields):
+    """Yields the fields of the Product rows as a JSON array one element at a time"""
+    count = 0
+    elapsed = 0.0
+    yield b"["
+    for row in rows:
+        count += 1
+        started = perf_counter()
+        item = (b"," if count > 1 else b"") + serializers.dumps(serializers.serialize_row(row, fields))
+        elapsed += perf_counter() - started
+        yield item
+    yield b"]\n"
+    metrics.SERIALIZATION_SECONDS.labels(metrics.route()).observe(elapsed)
+    metrics.products_returned(count)
+    app.logger.info("[%s] Products streamed", count)
@@ -0,0 +1,81 @@
+"""
+Product Serializers
+
+Fast path for turning many Products into JSON. Rows are read as plain
+column tuples, which skips building ORM instances and the identity map,
+and are encoded with orjson when it is installed. The bytes produced are
+the same as ``jsonify([product.serialize() for product in products])``.
+"""
+import json
+from decimal import Decimal
+from service.models import Product, DataValidationError
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Columns read for each Product, in the order of Product.serialize()
+PRODUCT_COLUMNS = (
+    Product.id,
+    Product.name,
+    Product.description,
+    Product.price,
+    Product.available,
+    Product.category,
+)
+
+# Field names a client can ask for with ?fields=
+FIELDS = tuple(column.key for column in PRODUCT_COLUMNS)
+
+
+def parse_fields(value):
+    """Returns the field names listed in a ?fields= value, every field when empty"""
+    if not value:
+        return FIELDS
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown or not fields:
+        raise DataValidationError(f"Invalid fields: {', '.join(unknown) or value}")
+    return fields
+
+
+def project(query, fields=FIELDS, extra=()):
+    """
+    Returns a query for only the given columns of a Product query
+
+    ``extra`` names columns that are needed to page or to build validators
+    but are not part of the response.
+    """
+    names = dict.fromkeys(fields + tuple(extra))
+    return query.with_entities(*[getattr(Product, name) for name in names])
+
+
+def serialize_row(row, fields=FIELDS):
+    """Serializes the given fields of a row made by project() into a dictionary"""
+    data = {name: getattr(row, name) for name in fields}
+    category = data.get("category")
+    if category is not None and not isinstance(category, str):
+        data["category"] = category.name
+    return data
+
+
+def _default(value):
+    """Encodes the values the JSON modules do not know like Flask does"""
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """
+    Encodes data as compact JSON bytes with sorted keys
+
+    orjson writes non-ASCII text as UTF-8 while Flask escapes it, so those
+    payloads go through the standard library to stay byte for byte equal.
+    """
+    if orjson is not None:
+        body = orjson.dumps(data, default=_default, option=orjson.OPT_SORT_KEYS)
+        if body.isascii():
+            return body
+    return json.dumps(data, default=_default, sort_keys=True, separators=(",", ":")).encode("ascii")
@@ -0,0 +1,203 @@
+"""
+Product Import and Export
+
+Readers and writers for moving many Products in and out of the service
+as CSV, newline delimited JSON or Parquet files one record or one batch
+at a time, so the size of a file is never limited by memory.
+"""
+import csv
+import io
+import json
+from decimal import Decimal
+from service import serializers
+from service.models import db, Product, DataValidationError
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+FORMATS = ("csv", "ndjson")
+EXPORT_FORMATS = FORMATS + ("parquet",)
+
+# Spellings of a boolean accepted in CSV files, t and f are what COPY writes
+TRUE_VALUES = ("true", "yes", "1", "t")
+FALSE_VALUES = ("false", "no", "0", "f")
+
+
+def guess_format(filename):
+    """Returns the format implied by a file name, ndjson when it is unknown"""
+    for fmt in EXPORT_FORMATS:
+        if filename.lower().endswith("." + fmt):
+            return fmt
+    return "ndjson"
+
+
+def read_records(stream, fmt):
+    """
+    Yields (line number, record) for every record of a CSV or NDJSON stream
+
+    NDJSON records are the raw lines, they are decoded by validate() so a
+    broken line is rejected instead of stopping the import.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for number, line in enumerate(stream, start=1):
+            if line.strip():
+                yield number, line.rstrip("\n")
+
+
+def _from_csv(record):
+    """Converts the strings of a CSV record to the types of a JSON one"""
+    data = {key: value for key, value in record.items() if key is not None}
+    if not data.get("description"):
+        data["description"] = None
+    available = data.get("available")
+    if available in (None, ""):
+        data.pop("available", None)
+    elif available.lower() in TRUE_VALUES:
+        data["available"] = True
+    elif available.lower() in FALSE_VALUES:
+        data["available"] = False
+    return data
+
+
+def validate(record):
+    """
+    Returns the column values of a record checked with Product.deserialize()
+
+    Raises:
+        DataValidationError: when the record is not a valid Product
+    """
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as error:
+            raise DataValidationError("Invalid JSON: " + str(error)) from error
+    elif isinstance(record, dict):
+        record = _from_csv(record)
+    if not isinstance(record, dict):
+        raise DataValidationError("Invalid product: not an object")
+    product = Product()
+    product.deserialize(record)
+    return {
+        "name": product.name,
+        "description": product.description,
+        "price": product.price,
+        "available": product.available,
+        "category": product.category,
+    }
+
+
+######################################################################
+#  E X P O R T   W R I T E R S
+######################################################################
+
+
+def _csv_value(value):
+    """Formats a column value the way COPY writes it in CSV"""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if value is not None and not isinstance(value, (str, int, Decimal, float)):
+        return value.name
+    return value
+
+
+def write_csv(rows, fields, stream):
+    """Writes rows made by serializers.project() to a binary stream as CSV"""
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow([_csv_value(getattr(row, name)) for name in fields])
+        count += 1
+    text.detach()
+    return count
+
+
+def write_ndjson(rows, fields, stream):
+    """Writes rows made by serializers.project() to a binary stream as NDJSON"""
+    count = 0
+    for row in rows:
+        stream.write(serializers.dumps(serializers.serialize_row(row, fields)) + b"\n")
+        count += 1
+    return count
+
+
+PARQUET_TYPES = {
+    "id": "int64",
+    "name": "string",
+    "description": "string",
+    "price": "float64",
+    "available": "bool_",
+    "category": "string",
+}
+
+
+def write_parquet(rows, fields, stream, batch_size=1000):
+    """
+    Writes rows made by serializers.project() to a binary stream as Parquet
+
+    Every ``batch_size`` rows become one row group, which is all that is
+    held in memory at a time.
+
+    Raises:
+        RuntimeError: when pyarrow is not installed
+    """
+    if pyarrow is None:
+        raise RuntimeError("Parquet output needs pyarrow, install it with: pip install pyarrow")
+    schema = pyarrow.schema([(name, getattr(pyarrow, PARQUET_TYPES[name])()) for name in fields])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(stream, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(serializers.serialize_row(row, fields))
+            if len(batch) >= batch_size:
+                count += _write_row_group(writer, schema, batch)
+        count += _write_row_group(writer, schema, batch)
+    return count
+
+
+def _write_row_group(writer, schema, batch):
+    """Writes a batch of serialized rows as one Parquet row group and empties it"""
+    if not batch:
+        return 0
+    columns = {name: [row[name] for row in batch] for name in schema.names}
+    if "price" in columns:
+        columns["price"] = [float(price) for price in columns["price"]]
+    writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+    count = len(batch)
+    batch.clear()
+    return count
+
+
+def copy_csv(query, stream):
+    """
+    Writes a projected Product query to a binary stream with COPY TO STDOUT
+
+    PostgreSQL formats the rows itself, which is the fastest way out of
+    the database. The output matches write_csv().
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="", write_through=True)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(copy_sql(query.statement, db.engine.dialect), text)
+    text.detach()
+    return cursor.rowcount
+
+
+def copy_sql(statement, dialect):
+    """
+    Returns the COPY TO STDOUT command that writes a SELECT as CSV
+
+    COPY takes no parameters, so the values are rendered into the SQL.
+    This compiles with the named paramstyle because under psycopg2's
+    pyformat every % would be doubled for a substitution copy_expert()
+    never makes.
+    """
+    select = statement.compile(dialect=type(dialect)(paramstyle="named"), compile_kwargs={"literal_binds": True})
+    return f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)"
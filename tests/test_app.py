@@ -0,0 +1,85 @@
+"""
+Test cases for the application factory
+"""
+import os
+import tempfile
+from unittest import TestCase
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import service
+from service import create_app
+from service.models import db
+
+SETTINGS = {"SLOW_QUERY_THRESHOLD_MS": -1, "SQLALCHEMY_ENGINE_OPTIONS": {}}
+
+
+class TestCreateApp(TestCase):
+    """Test making apps"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.uri = "sqlite:///" + os.path.join(self.tmp.name, "products.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_separate_apps(self):
+        """It should make a new app with the routes and settings on every call"""
+        app = create_app(dict(SETTINGS, SQLALCHEMY_DATABASE_URI=self.uri, MAX_PAGE_SIZE=7))
+        other = create_app(SETTINGS)
+        self.assertIsNot(app, other)
+        self.assertEqual(app.config["MAX_PAGE_SIZE"], 7)
+        self.assertNotEqual(other.config["MAX_PAGE_SIZE"], 7)
+        rules = {rule.rule for rule in app.url_map.iter_rules()}
+        self.assertIn("/products/<int:product_id>", rules)
+        self.assertIn("/metrics", rules)
+        self.assertGreater(app.config["STARTUP_SECONDS"], 0)
+
+    def test_config_object(self):
+        """It should take the settings from an object too"""
+        class Settings:  # pylint: disable=too-few-public-methods
+            """Settings of the app"""
+            SLOW_QUERY_THRESHOLD_MS = -1
+            SQLALCHEMY_DATABASE_URI = self.uri
+            MAX_PAGE_SIZE = 3
+        self.assertEqual(create_app(Settings).config["MAX_PAGE_SIZE"], 3)
+
+    def test_no_tables_on_start(self):
+        """It should leave the tables to flask db-init"""
+        app = create_app(dict(SETTINGS, SQLALCHEMY_DATABASE_URI=self.uri))
+        with app.app_context():
+            self.assertEqual(sqlalchemy.inspect(db.engine).get_table_names(), [])
+        result = app.test_cli_runner().invoke(args=["db-init"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with app.app_context():
+            self.assertIn("product", sqlalchemy.inspect(db.engine).get_table_names())
+
+    def test_default_app(self):
+        """It should make the default app once, when it is first used"""
+        self.assertIs(service.app, service.app)
+        self.assertRaises(AttributeError, getattr, service, "missing")
+
+    def test_errors_and_metrics(self):
+        """It should answer errors as JSON and count every request"""
+        app = create_app(dict(SETTINGS, SQLALCHEMY_DATABASE_URI=self.uri))
+        with app.test_client() as client:
+            response = client.post("/products", data="x", content_type="text/plain")
+            self.assertEqual(response.status_code, 415)
+            self.assertEqual(response.get_json()["error"], "Unsupported media type")
+            response.close()
+            self.assertIn(b'route="/products",status="415"', client.get("/metrics").data)
+
+    def test_slow_queries_per_app(self):
+        """It should time the statements of an app on its own engine only"""
+        settings = dict(SETTINGS, SQLALCHEMY_DATABASE_URI=self.uri, SLOW_QUERY_THRESHOLD_MS=10000)
+        first = create_app(settings)
+        second = create_app(settings)
+        log = first.extensions["slow_queries"]
+        self.addCleanup(log.remove)
+        self.addCleanup(second.extensions["slow_queries"].remove)
+        with first.app_context():
+            self.assertTrue(event.contains(db.engine, "after_cursor_execute", log.after_cursor_execute))
+        with second.app_context():
+            self.assertFalse(event.contains(db.engine, "after_cursor_execute", log.after_cursor_execute))
+        self.assertFalse(event.contains(Engine, "after_cursor_execute", log.after_cursor_execute))
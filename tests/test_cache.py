@@ -0,0 +1,184 @@
+"""
+Test cases for the Cache Backends
+"""
+from unittest import TestCase
+import redis
+from flask import Flask
+from service.common.cache import CacheBackend, LRUCache, NullCache, RedisCache, init_app
+
+
+class FakeTimer:
+    """A clock the tests can move forward"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """The part of the redis client RedisCache uses, kept in a dict"""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, px=None):
+        self.data[key] = value.encode()
+        self.expires[key] = px
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in self.data if key.startswith(match.rstrip("*"))]
+
+
+class BrokenRedis:
+    """A redis client whose server cannot be reached"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise redis.ConnectionError("Connection refused")
+        return fail
+
+
+class TestLRUCache(TestCase):
+    """Test the in-process LRU cache"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = LRUCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_hit_and_miss(self):
+        """It should count hits and misses"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, {"name": "Hat"})
+        self.assertEqual(self.cache.get(1), {"name": "Hat"})
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used key when full"""
+        self.cache.set(1, "a")
+        self.cache.set(2, "b")
+        self.cache.get(1)
+        self.cache.set(3, "c")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), "a")
+        self.assertEqual(self.cache.get(3), "c")
+
+    def test_expire_after_ttl(self):
+        """It should treat entries older than the ttl as misses"""
+        self.cache.set(1, "a")
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get(1))
+
+    def test_shorter_ttl(self):
+        """It should keep an entry for less than the ttl when asked to"""
+        self.cache.set(1, "a", ttl=2)
+        self.cache.set(2, "b", ttl=20)
+        self.timer.now = 5
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(2), "b")
+
+    def test_delete_and_clear(self):
+        """It should invalidate one key or all of them"""
+        self.cache.set(1, "a")
+        self.cache.set(2, "b")
+        self.cache.delete(1)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+
+    def test_disabled(self):
+        """It should store nothing when maxsize is 0"""
+        cache = LRUCache(maxsize=0)
+        cache.set(1, "a")
+        self.assertIsNone(cache.get(1))
+
+    def test_backend_interface(self):
+        """It should require backends to implement the interface"""
+        backend = CacheBackend()
+        self.assertRaises(NotImplementedError, backend.get, 1)
+        self.assertRaises(NotImplementedError, backend.set, 1, "a")
+        self.assertRaises(NotImplementedError, backend.delete, 1)
+        self.assertRaises(NotImplementedError, backend.clear)
+
+
+class TestNullCache(TestCase):
+    """Test the backend used when caching is off"""
+
+    def test_stores_nothing(self):
+        """It should never return a value or count lookups"""
+        cache = NullCache()
+        self.assertFalse(cache.enabled)
+        cache.set(1, "a")
+        self.assertIsNone(cache.get(1))
+        cache.delete(1)
+        cache.clear()
+        self.assertEqual(cache.stats(), {"hits": 0, "misses": 0})
+
+
+class TestRedisCache(TestCase):
+    """Test the cache shared through Redis"""
+
+    def setUp(self):
+        self.client = FakeRedis()
+        self.cache = RedisCache(ttl=1.5, client=self.client)
+
+    def test_get_and_set(self):
+        """It should store JSON values under the prefix with the time to live"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, {"name": "Hat", "price": "12.50"})
+        self.assertEqual(self.cache.get(1), {"name": "Hat", "price": "12.50"})
+        self.assertEqual(self.client.expires, {"products:cache:1": 1500})
+        self.cache.set(2, "b", ttl=0.5)
+        self.assertEqual(self.client.expires["products:cache:2"], 500)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_delete_and_clear(self):
+        """It should remove its own keys only"""
+        self.client.data["other"] = b"1"
+        self.cache.set(1, "a")
+        self.cache.set(2, "b")
+        self.cache.delete(1)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(list(self.client.data), ["other"])
+
+    def test_unreachable_server(self):
+        """It should log errors talking to Redis and treat them as misses"""
+        self.client = BrokenRedis()
+        self.cache = RedisCache(client=self.client)
+        with self.assertLogs("flask.app", level="WARNING") as logs:
+            self.cache.set(1, "a")
+            self.assertIsNone(self.cache.get(1))
+            self.cache.delete(1)
+            self.cache.clear()
+        self.assertEqual(len(logs.records), 4)
+        self.assertEqual(self.cache.stats(), {"hits": 0, "misses": 1})
+
+
+class TestInitApp(TestCase):
+    """Test choosing the backend from the app config"""
+
+    def make_app(self, **settings):
+        """Returns an app with the given settings"""
+        app = Flask(__name__)
+        app.config.update(settings)
+        return app
+
+    def test_backends(self):
+        """It should pick the backend named by PRODUCT_CACHE_BACKEND"""
+        self.assertIsInstance(init_app(self.make_app()), NullCache)
+        cache = init_app(self.make_app(PRODUCT_CACHE_BACKEND="memory", PRODUCT_CACHE_SIZE=5, PRODUCT_CACHE_TTL=3))
+        self.assertEqual((cache.maxsize, cache.ttl), (5, 3))
+        cache = init_app(self.make_app(PRODUCT_CACHE_BACKEND="redis", PRODUCT_CACHE_URL="redis://cache:6379/2"))
+        self.assertIsInstance(cache, RedisCache)
+        self.assertRaises(ValueError, init_app, self.make_app(PRODUCT_CACHE_BACKEND="disk"))
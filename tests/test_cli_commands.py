@@ -1,11 +1,18 @@
 """
 CLI Command Extensions for Flask
 """
+import csv
+import json
 import os
+import tempfile
+from decimal import Decimal
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from sqlalchemy.dialects.postgresql import psycopg2
+from service import app, transfer
+from service.common.cli_commands import db_create, products_stats_rebuild, products_import, products_export
+from service.models import db, Product, ProductStats
 
 
 class TestFlaskCLI(TestCase):
@@ -18,6 +25,169 @@ class TestFlaskCLI(TestCase):
     def test_db_create(self, db_mock):
         """It should call the db-create command"""
         db_mock.return_value = MagicMock()
-        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
-            result = self.runner.invoke(db_create)
-            self.assertEqual(result.exit_code, 0)
+        result = app.test_cli_runner().invoke(db_create)
+        self.assertEqual(result.exit_code, 0)
+        db_mock.drop_all.assert_called_once()
+        db_mock.create_all.assert_called_once()
+
+    @patch('service.common.cli_commands.ProductStats')
+    @patch('service.common.cli_commands.db')
+    def test_products_stats_rebuild(self, db_mock, stats_mock):
+        """It should recompute the stats with the products-stats-rebuild command"""
+        result = app.test_cli_runner().invoke(products_stats_rebuild)
+        self.assertEqual(result.exit_code, 0)
+        stats_mock.recompute.assert_called_once_with(db_mock.session.connection.return_value)
+        db_mock.session.commit.assert_called_once()
+
+
+class TestProductsTransfer(TestCase):
+    """Test the products-import and products-export commands against the database"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with app.app_context():
+            db.create_all()
+            db.session.query(Product).delete()
+            ProductStats.recompute(db.session.connection())
+            db.session.commit()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+            db.session.remove()
+
+    def write(self, name, text):
+        """Writes a file in the temporary directory and returns its path"""
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8") as source:
+            source.write(text)
+        return path
+
+    def test_import_csv(self):
+        """It should import the valid rows of a CSV file and reject the others"""
+        path = self.write("products.csv", (
+            "name,description,price,available,category\n"
+            "Hat,A red hat,12.50,true,CLOTHS\n"
+            "Hammer,,20,no,TOOLS\n"
+            "Spoon,A spoon,free,yes,HOUSEWARES\n"
+            "Wheel,A wheel,80,maybe,AUTOMOTIVE\n"
+        ))
+        result = app.test_cli_runner().invoke(products_import, [path, "--batch-size", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with app.app_context():
+            products = {product.name: product for product in Product.all()}
+            self.assertEqual(set(products), {"Hat", "Hammer"})
+            self.assertIsNone(products["Hammer"].description)
+            self.assertFalse(products["Hammer"].available)
+            self.assertEqual(products["Hat"].version, 1)
+            stats = {stats.category: stats.count for stats in ProductStats.all()}
+            self.assertEqual(stats["CLOTHS"], 1)
+            self.assertEqual(stats["TOOLS"], 1)
+        with open(path + ".rejects.ndjson", encoding="utf-8") as rejects:
+            lines = [json.loads(line) for line in rejects]
+        self.assertEqual([line["line"] for line in lines], [4, 5])
+        self.assertEqual(lines[0]["record"]["name"], "Spoon")
+
+    def test_import_failure_keeps_stats(self):
+        """It should keep the stats of the batches loaded before an import fails"""
+        path = self.write("products.csv", (
+            "name,description,price,available,category\n"
+            "Hat,A red hat,12.50,true,CLOTHS\n"
+            "Hammer,,20,no,TOOLS\n"
+        ))
+        copy_rows = Product.copy_rows
+
+        def fail_on_hammer(rows):
+            if rows[0]["name"] == "Hammer":
+                raise RuntimeError("Connection lost")
+            copy_rows(rows)
+
+        with patch.object(Product, "copy_rows", side_effect=fail_on_hammer):
+            result = app.test_cli_runner().invoke(products_import, [path, "--batch-size", "1"])
+        self.assertNotEqual(result.exit_code, 0)
+        with app.app_context():
+            db.session.rollback()
+            self.assertEqual([product.name for product in Product.all()], ["Hat"])
+            stats = {stats.category: stats.count for stats in ProductStats.all()}
+            self.assertEqual((stats["CLOTHS"], stats["TOOLS"]), (1, 0))
+
+    def test_import_ndjson(self):
+        """It should import an NDJSON file and reject lines that are not products"""
+        path = self.write("products.ndjson", (
+            '{"name": "Bread", "description": "Rye", "price": 3.5, "available": true, "category": "FOOD"}\n'
+            "\n"
+            "not json\n"
+            '{"description": "no name", "price": 1, "category": "FOOD"}\n'
+        ))
+        rejects = os.path.join(self.tmp.name, "rejects.ndjson")
+        result = app.test_cli_runner().invoke(products_import, [path, "--rejects", rejects])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 1 products, rejected 2", result.output)
+        with app.app_context():
+            self.assertEqual([product.name for product in Product.all()], ["Bread"])
+        with open(rejects, encoding="utf-8") as source:
+            self.assertEqual([json.loads(line)["line"] for line in source], [3, 4])
+
+    def test_export_csv(self):
+        """It should export the filtered products as CSV"""
+        path = self.write("products.ndjson", "".join(
+            json.dumps({"name": name, "description": None, "price": price, "available": True, "category": category}) + "\n"
+            for name, price, category in [("Bread", 3.5, "FOOD"), ("Milk", 1.25, "FOOD"), ("Saw", 30, "TOOLS")]
+        ))
+        self.assertEqual(app.test_cli_runner().invoke(products_import, [path]).exit_code, 0)
+        output = os.path.join(self.tmp.name, "food.csv")
+        result = app.test_cli_runner().invoke(
+            products_export, [output, "--category", "food", "--fields", "name,price,available", "--batch-size", "1"]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Exported 2 products", result.output)
+        with open(output, encoding="utf-8", newline="") as source:
+            rows = list(csv.reader(source))
+        self.assertEqual(rows[0], ["name", "price", "available"])
+        self.assertEqual([(name, Decimal(price), available) for name, price, available in rows[1:]], [
+            ("Bread", Decimal("3.5"), "t"),
+            ("Milk", Decimal("1.25"), "t"),
+        ])
+
+    def test_export_round_trip(self):
+        """It should export NDJSON that products-import loads back"""
+        path = self.write("products.csv", "name,description,price,available,category\nHat,Red,12.5,no,CLOTHS\n")
+        self.assertEqual(app.test_cli_runner().invoke(products_import, [path]).exit_code, 0)
+        output = os.path.join(self.tmp.name, "products.ndjson")
+        result = app.test_cli_runner().invoke(products_export, [output, "--unavailable"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(output, encoding="utf-8") as source:
+            record = json.loads(source.readline())
+        self.assertEqual(record["name"], "Hat")
+        self.assertFalse(record["available"])
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+        self.assertEqual(app.test_cli_runner().invoke(products_import, [output]).exit_code, 0)
+        with app.app_context():
+            self.assertEqual([product.name for product in Product.all()], ["Hat"])
+
+    def test_export_bad_fields(self):
+        """It should reject unknown fields"""
+        result = app.test_cli_runner().invoke(products_export, ["--fields", "colour"])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn("Invalid fields: colour", result.output)
+
+    @patch("service.transfer.pyarrow", None)
+    def test_export_parquet_without_pyarrow(self):
+        """It should explain that Parquet output needs pyarrow"""
+        output = os.path.join(self.tmp.name, "products.parquet")
+        result = app.test_cli_runner().invoke(products_export, [output])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("needs pyarrow", result.output)
+
+    def test_copy_sql(self):
+        """It should render the values of a COPY export without doubling % signs"""
+        statement = db.select(Product.name).where(Product.name.op("%")("o'brien"), Product.name == "x%y")
+        self.assertEqual(
+            transfer.copy_sql(statement, psycopg2.dialect()),
+            "COPY (SELECT product.name \nFROM product \nWHERE (product.name % 'o''brien') AND product.name = 'x%y') "
+            "TO STDOUT WITH (FORMAT csv, HEADER)",
+        )
@@ -0,0 +1,131 @@
+"""
+Test cases for the load generator
+"""
+import asyncio
+import threading
+from unittest import TestCase
+from werkzeug.serving import make_server
+from service import app
+from service.common import loadtest
+from service.models import db, Product
+from tests.factories import ProductFactory
+
+
+class BrokenConnection:
+    """A connection that is reset before any answer arrives"""
+
+    async def request(self, method, path, body=None):
+        raise ConnectionResetError(f"{method} {path} was reset")
+
+    def close(self):
+        pass
+
+
+class TestParseMix(TestCase):
+    """Test reading route mixes"""
+
+    def test_parse_mix(self):
+        """It should read the weights of the routes"""
+        self.assertEqual(loadtest.parse_mix("get=3, list=1"), {"get": 3.0, "list": 1.0})
+        self.assertEqual(loadtest.parse_mix("create"), {"create": 1.0})
+
+    def test_bad_mix(self):
+        """It should reject unknown routes and mixes without weight"""
+        self.assertRaises(ValueError, loadtest.parse_mix, "get=1,patch=1")
+        self.assertRaises(ValueError, loadtest.parse_mix, "get=0")
+
+
+class TestLoadTest(TestCase):
+    """Test load tests against a local server"""
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.query(Product).delete()
+            db.session.commit()
+            for product in ProductFactory.create_batch(5):
+                product.create()
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+
+    def run_test(self, **options):
+        """Runs a short load test and returns its report"""
+        mix = loadtest.parse_mix(loadtest.DEFAULT_MIX)
+        test = loadtest.LoadTest(self.url, mix, duration=0.5, seed=1, **options)
+        return asyncio.run(test.run())
+
+    def test_closed_loop(self):
+        """It should keep the connections busy and report every route"""
+        report = self.run_test(concurrency=4)
+        routes = report["routes"]
+        self.assertEqual(set(routes), {"get", "list", "create", "update", "delete", "all"})
+        self.assertGreater(routes["all"]["requests"], 0)
+        self.assertEqual(routes["all"]["errors"], 0)
+        self.assertEqual(routes["all"]["requests"], sum(routes[route]["requests"] for route in loadtest.ROUTES))
+        self.assertLessEqual(routes["all"]["p50_ms"], routes["all"]["p99_ms"])
+        self.assertEqual(report["mode"], "concurrency 4")
+
+    def test_open_loop(self):
+        """It should start requests at the target rate"""
+        report = self.run_test(concurrency=4, rate=40)
+        self.assertEqual(report["routes"]["all"]["requests"], 20)
+        self.assertEqual(report["routes"]["all"]["errors"], 0)
+
+    def test_deletes_only_own_products(self):
+        """It should only delete the products it made"""
+        asyncio.run(loadtest.LoadTest(self.url, {"delete": 1}, duration=0.3, concurrency=2).run())
+        with app.app_context():
+            self.assertEqual(db.session.query(Product).count(), 5)
+
+    def test_writes_only_own_products(self):
+        """It should only update the products it made and delete them at the end"""
+        with app.app_context():
+            before = {product.id: product.serialize() for product in Product.all()}
+        report = asyncio.run(loadtest.LoadTest(self.url, {"create": 1, "update": 2}, duration=0.3, concurrency=2).run())
+        self.assertGreater(report["routes"]["update"]["requests"], 0)
+        self.assertEqual(report["routes"]["all"]["errors"], 0)
+        with app.app_context():
+            self.assertEqual({product.id: product.serialize() for product in Product.all()}, before)
+
+    def test_failed_delete_cleaned_up(self):
+        """It should keep a product whose delete failed for the clean up at the end"""
+        test = loadtest.LoadTest(self.url, {"delete": 1}, duration=0.1)
+        test.keep(0)
+        asyncio.run(test.call(BrokenConnection(), "delete"))
+        self.assertEqual(test.errors["delete"], 1)
+        self.assertEqual(test.created, [0])
+        self.assertEqual(test.writing, set())
+
+    def test_deleted_while_in_flight(self):
+        """It should not count a 404 for a product it deleted as an error"""
+        test = loadtest.LoadTest(self.url, {"get": 1}, duration=0.2, concurrency=1)
+        test.ids = [0]
+        test.deleted.add(0)
+        asyncio.run(test.closed_loop(loadtest.time.perf_counter() + 0.2))
+        self.assertGreater(len(test.timings["get"]), 0)
+        self.assertEqual(test.errors["get"], 0)
+
+    def test_errors(self):
+        """It should count answers with an unexpected status as errors"""
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+        test = loadtest.LoadTest(self.url, {"get": 1}, duration=0.2, concurrency=1)
+        test.ids = [0]
+        asyncio.run(test.closed_loop(loadtest.time.perf_counter() + 0.2))
+        self.assertGreater(test.errors["get"], 0)
+        self.assertEqual(test.errors["get"], len(test.timings["get"]))
+
+    def test_unreachable(self):
+        """It should fail when the service cannot be reached"""
+        test = loadtest.LoadTest("http://127.0.0.1:1", {"get": 1}, duration=0.1)
+        self.assertRaises(OSError, asyncio.run, test.run())
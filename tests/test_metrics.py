@@ -0,0 +1,78 @@
+"""
+Test cases for the Prometheus metrics
+"""
+from unittest import TestCase
+from prometheus_client.parser import text_string_to_metric_families
+from service import app
+from service.common import status
+from service.models import db, Product
+from tests.factories import ProductFactory
+
+
+def sample(text, name, **labels):
+    """Returns the value of one sample of the /metrics text, 0 when it is missing"""
+    for family in text_string_to_metric_families(text):
+        for found in family.samples:
+            if found.name == name and found.labels == labels:
+                return found.value
+    return 0.0
+
+
+class TestMetrics(TestCase):
+    """Test the /metrics endpoint"""
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.query(Product).delete()
+            for _ in range(3):
+                ProductFactory().create()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+            db.session.remove()
+
+    def get(self, url):
+        """Reads and closes a response like a WSGI server does"""
+        with self.client.get(url) as response:
+            response.get_data()
+
+    def scrape(self):
+        """Returns the current metrics text"""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        return response.get_data(as_text=True)
+
+    def test_request_metrics(self):
+        """It should count requests by route and status and time them"""
+        before = self.scrape()
+        self.get("/products")
+        self.get("/products/0")
+        after = self.scrape()
+        for name, labels in [
+            ("http_requests_total", {"method": "GET", "route": "/products", "status": "200"}),
+            ("http_request_duration_seconds_count", {"method": "GET", "route": "/products", "status": "200"}),
+            ("http_requests_total", {"method": "GET", "route": "/products/<int:product_id>", "status": "404"}),
+        ]:
+            self.assertEqual(sample(after, name, **labels) - sample(before, name, **labels), 1, name)
+
+    def test_list_metrics(self):
+        """It should record the database work, serialization and rows of a list"""
+        before = self.scrape()
+        self.get("/products")
+        self.get("/products?stream=true")
+        after = self.scrape()
+
+        def delta(name, **labels):
+            return sample(after, name, route="/products", **labels) - sample(before, name, route="/products", **labels)
+        self.assertEqual(delta("http_request_db_queries_count"), 2)
+        # fingerprint and rows for the list, rows only for the stream
+        self.assertEqual(delta("http_request_db_queries_sum"), 3)
+        self.assertGreater(delta("http_request_db_seconds_sum"), 0)
+        self.assertEqual(delta("serialization_seconds_count"), 2)
+        self.assertEqual(delta("products_returned_sum"), 6)
+        self.assertEqual(delta("products_returned_bucket", le="10.0"), 2)
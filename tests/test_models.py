@@ -3,8 +3,11 @@ Test cases for Product Model
 """
 import logging
 import pytest
+from sqlalchemy import create_engine
 from werkzeug.exceptions import NotFound
-from service.models import Product, db, DataValidationError
+from service.models import Product, ProductStats, Category, db, DataValidationError, ConcurrencyError
+from service.models import add_missing_columns
+from service.common.cache import LRUCache
 from tests.factories import ProductFactory
 
 # Configure logging
@@ -59,7 +62,7 @@ class TestProductModel:
         product.create()
         
         assert product.id is not None
-        assert Product.all().count() == 1
+        assert len(Product.all()) == 1
 
     def test_read_product(self, database):
         """It should read a Product from the database"""
@@ -92,7 +95,7 @@ class TestProductModel:
         # Verify changes
         assert product.id == original_id
         assert product.description == new_description
-        assert Product.all().count() == 1
+        assert len(Product.all()) == 1
         
         # Verify in database
         updated_product = Product.find(original_id)
@@ -102,21 +105,21 @@ class TestProductModel:
         """It should delete a Product from the database"""
         product = ProductFactory()
         product.create()
-        assert Product.all().count() == 1
+        assert len(Product.all()) == 1
         
         product.delete()
-        assert Product.all().count() == 0
+        assert len(Product.all()) == 0
 
     def test_list_all_products(self, database):
         """It should list all Products in the database"""
-        assert Product.all().count() == 0
+        assert len(Product.all()) == 0
         
         # Create test data
         products = ProductFactory.create_batch(5)
         for product in products:
             product.create()
         
-        assert Product.all().count() == 5
+        assert len(Product.all()) == 5
 
     def test_find_by_name(self, database):
         """It should find Products by name"""
@@ -216,4 +219,263 @@ class TestProductModel:
         product = ProductFactory()
         product.id = 999999
         with pytest.raises(NotFound):
-            product.delete()
\ No newline at end of file
+            product.delete()
+
+    def test_paginate_products(self, database):
+        """It should page through Products without gaps or repeats"""
+        for product in ProductFactory.create_batch(5):
+            product.create()
+
+        for sort in ("id", "-price", "name"):
+            page, position = Product.paginate(Product.search(sort), 2, sort=sort)
+            assert len(page) == 2
+            assert position["id"] == page[-1].id
+
+            seen = [product.id for product in page]
+            while position is not None:
+                page, position = Product.paginate(Product.search(sort), 2, position, sort)
+                seen.extend(product.id for product in page)
+            assert seen == [product.id for product in Product.search(sort)]
+
+        with pytest.raises(DataValidationError):
+            Product.paginate(Product.search("name"), 2, {"id": 1}, "name")
+
+    def test_paginate_invalid_position(self, database):
+        """It should refuse page positions that are not scalars of the sort column"""
+        for sort, position in (
+            ("name", {"sort": "name", "id": 1, "key": [1, 2]}),
+            ("name", {"sort": "name", "id": 1, "key": 5}),
+            ("price", {"sort": "price", "id": 1, "key": {"a": 1}}),
+            ("price", {"sort": "price", "id": 1, "key": True}),
+            ("id", {"sort": "id", "id": "1"}),
+            ("id", {"sort": "id", "id": [1]}),
+        ):
+            with pytest.raises(DataValidationError):
+                Product.paginate(Product.search(sort), 2, position, sort)
+
+    def test_stream_products(self, database):
+        """It should stream every Product of a query in batches"""
+        for product in ProductFactory.create_batch(5):
+            product.create()
+
+        streamed = [product.id for product in Product.stream(Product.query.order_by(Product.id), 2)]
+        assert streamed == sorted(product.id for product in Product.all())
+
+    def test_bulk_create_products(self, database):
+        """It should create many Products in one transaction"""
+        products = ProductFactory.create_batch(5)
+        Product.bulk_create(products, chunk_size=2)
+
+        assert all(product.id is not None for product in products)
+        assert len(Product.all()) == 5
+
+    def test_bulk_update_products(self, database):
+        """It should update every matching Product with one statement"""
+        ProductFactory(category=Category.FOOD, available=True).create()
+        ProductFactory(category=Category.FOOD, available=False).create()
+        ProductFactory(category=Category.TOOLS).create()
+
+        count = Product.bulk_update(Product.criteria(category=Category.FOOD), {"price": "9.99"})
+        assert count == 2
+        assert Product.find_by_category(Category.FOOD).filter(Product.price == 9.99).count() == 2
+
+        with pytest.raises(DataValidationError):
+            Product.bulk_update([], {"category": "NOT_A_CATEGORY"})
+        for changes in ({"name": 12}, {"name": None}, {"description": ["a"]}, {"price": "nan"},
+                        {"price": float("inf")}, {"price": True}):
+            with pytest.raises(DataValidationError):
+                Product.bulk_update([], changes)
+
+    def test_bulk_delete_products(self, database):
+        """It should delete every matching Product with one statement"""
+        products = ProductFactory.create_batch(4)
+        for product in products:
+            product.create()
+
+        ids = [products[0].id, products[1].id]
+        assert Product.bulk_delete(Product.criteria(ids=ids)) == 2
+        assert len(Product.all()) == 2
+
+    def test_delete_product_by_id(self, database):
+        """It should delete a Product by id without loading it"""
+        product = ProductFactory()
+        product.create()
+
+        assert Product.delete_by_id(product.id) is True
+        assert Product.find(product.id) is None
+        assert Product.delete_by_id(product.id) is False
+
+    def test_find_product_cached(self, database, monkeypatch):
+        """It should serve repeated lookups from the cache until a write"""
+        monkeypatch.setattr(Product, "cache", LRUCache())
+        product = ProductFactory()
+        product.create()
+
+        Product.find(product.id)
+        found = Product.find(product.id)
+        assert Product.cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+        assert found.name == product.name
+        assert found.price == product.price
+        assert found.category == product.category
+
+        found.name = "Renamed"
+        found.update()
+        assert Product.find(product.id).name == "Renamed"
+
+        assert Product.delete_by_id(product.id)
+        assert Product.find(product.id) is None
+
+    def test_product_etag_changes_on_update(self, database):
+        """It should give a Product a new etag and fingerprint when it changes"""
+        product = ProductFactory()
+        product.create()
+        etag = product.etag()
+        assert Product.fingerprint(Product.query) == (1, product.updated_at)
+
+        product.description = "Updated description"
+        product.update()
+        assert product.etag() != etag
+        assert Product.fingerprint(Product.query) == (1, product.updated_at)
+
+    def test_update_unchanged_product(self, database):
+        """It should keep the version and modification time of a Product saved without changes"""
+        product = ProductFactory()
+        product.create()
+        etag, updated_at = product.etag(), product.updated_at
+
+        product.update()
+        assert (product.etag(), product.updated_at) == (etag, updated_at)
+
+    def test_update_product_conflict(self, database):
+        """It should refuse to overwrite a Product changed since it was read"""
+        product = ProductFactory()
+        product.create()
+        assert product.version == 1
+        assert product.etag() == f"{product.id}-1"
+
+        with db.engine.begin() as connection:
+            connection.execute(
+                db.update(Product).where(Product.id == product.id).values(version=Product.version + 1)
+            )
+        product.description = "Lost update"
+        with pytest.raises(ConcurrencyError):
+            product.update()
+
+        product = Product.find(product.id)
+        assert product.version == 2
+        product.description = "Fresh update"
+        product.update()
+        assert product.version == 3
+
+    def test_update_deleted_product(self, database):
+        """It should refuse to update a Product deleted since it was read"""
+        product = ProductFactory()
+        product.create()
+        assert product.version == 1
+
+        with db.engine.begin() as connection:
+            connection.execute(db.delete(Product).where(Product.id == product.id))
+        product.description = "Lost update"
+        with pytest.raises(ConcurrencyError):
+            product.update()
+
+    def test_search_products(self, database):
+        """It should combine any mix of filters with a sort order"""
+        ProductFactory(category=Category.FOOD, available=True, price=5).create()
+        ProductFactory(category=Category.FOOD, available=True, price=50).create()
+        ProductFactory(category=Category.FOOD, available=False, price=20).create()
+        ProductFactory(category=Category.TOOLS, available=True, price=10).create()
+
+        found = Product.search("-price", category=Category.FOOD, available=True, min_price=1, max_price=60).all()
+        assert [float(product.price) for product in found] == [50, 5]
+
+        with pytest.raises(DataValidationError):
+            Product.search("weight")
+
+    def test_text_search_products(self, database):
+        """It should find Products by words and prefixes, best matches first"""
+        ProductFactory(name="Hammer", description="Heavy steel claw").create()
+        ProductFactory(name="Sledge", description="A big hammer").create()
+        ProductFactory(name="Towels", description="Soft cotton").create()
+
+        found = Product.search("rank", q="hamm").all()
+        assert [product.name for product in found] == ["Hammer", "Sledge"]
+        assert [product.name for product in Product.search(q="steel cla").all()] == ["Hammer"]
+
+        page, position = Product.paginate(Product.search("rank", q="hamm"), 1, sort="rank", q="hamm")
+        assert [product.name for product in page] == ["Hammer"]
+        page, position = Product.paginate(Product.search("rank", q="hamm"), 1, position, "rank", "hamm")
+        assert [product.name for product in page] == ["Sledge"]
+        assert position is None
+
+    def test_find_many_products(self, database):
+        """It should look up a list of ids in chunks"""
+        products = ProductFactory.create_batch(5)
+        for product in products:
+            product.create()
+
+        ids = [product.id for product in products] + [999999]
+        found = Product.find_many(Product.query, ids, chunk_size=2)
+        assert sorted(found) == sorted(ids[:5])
+        assert found[ids[0]].name == products[0].name
+
+    def test_product_stats(self, database):
+        """It should keep the category stats in step with every write"""
+        def stats():
+            return {row.category: row for row in ProductStats.all()}
+
+        ProductStats.recompute(db.session.connection())
+        db.session.commit()
+        cheap = ProductFactory(category=Category.FOOD, available=True, price=2)
+        dear = ProductFactory(category=Category.FOOD, available=False, price=10)
+        Product.bulk_create([cheap, dear])
+        tool = ProductFactory(category=Category.TOOLS, available=True, price=5)
+        tool.create()
+
+        food = stats()["FOOD"].serialize()
+        assert (food["count"], food["available"]) == (2, 1)
+        assert (float(food["min_price"]), float(food["avg_price"]), float(food["max_price"])) == (2, 6, 10)
+
+        tool.category = Category.FOOD.name
+        tool.price = 20
+        tool.update()
+        Product.delete_by_id(cheap.id)
+        food = stats()["FOOD"].serialize()
+        assert (food["count"], food["available"]) == (2, 1)
+        assert (float(food["min_price"]), float(food["max_price"])) == (10, 20)
+        assert stats()["TOOLS"].count == 0
+
+        Product.bulk_update(Product.criteria(category=Category.FOOD), {"available": True, "price": "4"})
+        food = stats()["FOOD"].serialize()
+        assert (food["count"], food["available"]) == (2, 2)
+        assert (float(food["min_price"]), float(food["max_price"])) == (4, 4)
+
+        Product.bulk_delete(Product.criteria(category=Category.FOOD))
+        assert stats()["FOOD"].serialize()["avg_price"] is None
+
+    def test_product_stats_rebuilt_on_mismatch(self, database, monkeypatch):
+        """It should rebuild the stats when a DELETE removes rows that were not totalled first"""
+        ProductStats.recompute(db.session.connection())
+        db.session.commit()
+        products = ProductFactory.create_batch(3, category=Category.CLOTHS)
+        Product.bulk_create(products)
+
+        locked_rows = Product.locked_rows
+        monkeypatch.setattr(Product, "locked_rows", lambda criteria: locked_rows([Product.id == products[0].id]))
+        assert Product.bulk_delete(Product.criteria(category=Category.CLOTHS)) == 3
+        assert ProductStats.query.filter_by(category="CLOTHS").one().count == 0
+
+    def test_add_missing_columns(self):
+        """It should add the new columns to an older product table and fill them in"""
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(db.text(
+                "CREATE TABLE product (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, description VARCHAR(250), "
+                "price NUMERIC NOT NULL, available BOOLEAN NOT NULL, category VARCHAR(10) NOT NULL)"
+            ))
+            connection.execute(db.text("INSERT INTO product VALUES (1, 'Hat', NULL, 10, 1, 'CLOTHS')"))
+            assert add_missing_columns(connection) == ["updated_at", "version"]
+            assert add_missing_columns(connection) == []
+            row = connection.execute(db.select(Product.__table__.c.updated_at, Product.__table__.c.version)).one()
+            assert row.updated_at is not None
+            assert row.version == 1
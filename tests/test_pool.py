@@ -0,0 +1,71 @@
+"""
+Test cases for the database connection pool
+"""
+import sqlite3
+import threading
+from unittest import TestCase
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import StaticPool
+from service.common.pool import InstrumentedQueuePool, stats, warm_up
+
+
+def connect():
+    """Opens a SQLite connection that can be shared between threads"""
+    return sqlite3.connect(":memory:", check_same_thread=False)
+
+
+class TestInstrumentedQueuePool(TestCase):
+    """Test the connection pool counters"""
+
+    def test_stats(self):
+        """It should report the connections in use and the checkouts"""
+        pool = InstrumentedQueuePool(connect, pool_size=2, max_overflow=1)
+        first = pool.connect()
+        second = pool.connect()
+        data = stats(pool)
+        self.assertEqual(data["pool"], "InstrumentedQueuePool")
+        self.assertEqual(data["size"], 2)
+        self.assertEqual(data["max_overflow"], 1)
+        self.assertEqual(data["in_use"], 2)
+        self.assertEqual(data["checkouts"], 2)
+        self.assertEqual(data["timeouts"], 0)
+        first.close()
+        second.close()
+        data = stats(pool)
+        self.assertEqual(data["in_use"], 0)
+        self.assertEqual(data["idle"], 2)
+
+    def test_wait_and_timeout(self):
+        """It should time checkouts that wait for a connection"""
+        pool = InstrumentedQueuePool(connect, pool_size=1, max_overflow=0, timeout=0.05)
+        connection = pool.connect()
+        self.assertRaises(exc.TimeoutError, pool.connect)
+        self.assertEqual(pool.timeouts, 1)
+        self.assertGreaterEqual(pool.max_wait_seconds, 0.05)
+
+        timer = threading.Timer(0.05, connection.close)
+        timer.start()
+        pool._timeout = 5  # pylint: disable=protected-access
+        pool.connect().close()
+        timer.join()
+        self.assertEqual(pool.checkouts, 3)
+        self.assertGreater(pool.wait_seconds, 0.09)
+
+    def test_stats_other_pool(self):
+        """It should only name pools that do not queue connections"""
+        self.assertEqual(stats(StaticPool(connect)), {"pool": "StaticPool"})
+
+    def test_warm_up(self):
+        """It should open the requested connections and leave them idle"""
+        engine = create_engine("sqlite://", creator=connect, poolclass=InstrumentedQueuePool, pool_size=3)
+        self.assertEqual(warm_up(engine, 3), 3)
+        data = stats(engine.pool)
+        self.assertEqual(data["idle"], 3)
+        self.assertEqual(data["in_use"], 0)
+
+    def test_warm_up_unreachable(self):
+        """It should not fail when the database cannot be reached"""
+        def refuse():
+            raise sqlite3.OperationalError("unable to open database file")
+        engine = create_engine("sqlite://", creator=refuse, poolclass=InstrumentedQueuePool)
+        self.assertEqual(warm_up(engine, 2), 0)
@@ -0,0 +1,74 @@
+"""
+Test cases for the request profiler
+"""
+import json
+import os
+import tempfile
+import pstats
+from unittest import TestCase
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from service import app
+from service.common import profiler
+from service.models import db, Product
+from tests.factories import ProductFactory
+
+
+class TestProfilerMiddleware(TestCase):
+    """Test profiling requests"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        event.listen(Engine, "before_cursor_execute", profiler.record_start)
+        event.listen(Engine, "after_cursor_execute", profiler.record_statement)
+        with app.app_context():
+            db.create_all()
+            db.session.query(Product).delete()
+            ProductFactory().create()
+
+    def tearDown(self):
+        event.remove(Engine, "before_cursor_execute", profiler.record_start)
+        event.remove(Engine, "after_cursor_execute", profiler.record_statement)
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+            db.session.remove()
+        self.tmp.cleanup()
+
+    def client(self, **kwargs):
+        """Returns a test client for the app wrapped in the profiler"""
+        return Client(profiler.ProfilerMiddleware(app.wsgi_app, **kwargs), Response)
+
+    def test_not_profiled(self):
+        """It should leave requests that do not ask alone"""
+        response = self.client().get("/products")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response.headers)
+
+    def test_profile_header(self):
+        """It should profile a request with an X-Profile header"""
+        response = self.client().get("/products", headers={"X-Profile": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 1)
+        self.assertRegex(response.headers["Server-Timing"], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="[1-9]\d* queries"$')
+        self.assertEqual(len(response.headers["X-Profile-Top"].split(", ")), profiler.TOP_FUNCTIONS)
+        self.assertNotIn("X-Profile-Id", response.headers)
+
+    def test_sampling(self):
+        """It should profile the sampled share of requests"""
+        client = self.client(sample_rate=0.5, sampler=iter([0.2, 0.7]).__next__)
+        self.assertIn("Server-Timing", client.get("/products").headers)
+        self.assertNotIn("Server-Timing", client.get("/products").headers)
+
+    def test_profile_directory(self):
+        """It should write the profile and the SQL statements of a streamed response"""
+        response = self.client(directory=self.tmp.name).get("/products?stream=true", headers={"X-Profile": "true"})
+        self.assertEqual(len(response.get_json()), 1)
+        path = os.path.join(self.tmp.name, response.headers["X-Profile-Id"])
+        self.assertGreater(pstats.Stats(path + ".prof").total_calls, 0)
+        with open(path + ".sql.json", encoding="utf-8") as source:
+            statements = json.load(source)
+        self.assertTrue(any("FROM product" in statement["statement"] for statement in statements))
+        self.assertTrue(all(statement["seconds"] >= 0 for statement in statements))
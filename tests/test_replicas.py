@@ -0,0 +1,150 @@
+"""
+Test cases for routing reads to read replicas
+
+The replica is a second SQLite file that does not replicate anything, so
+a read shows which database it was sent to.
+"""
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+from service import app
+from service.common import status
+from service.common.replicas import ReplicaSet, STICKY_COOKIE
+from service.models import db, Product, Category
+from tests.factories import ProductFactory
+
+
+class FakeTimer:
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReplicaSet(TestCase):
+    """Test picking a replica"""
+
+    def test_round_robin(self):
+        """It should take turns between healthy replicas"""
+        first, second = create_engine("sqlite://"), create_engine("sqlite://")
+        replicas = ReplicaSet([first, second])
+        self.assertEqual([replicas.choose() for _ in range(4)], [first, second, first, second])
+
+    def test_skip_unhealthy(self):
+        """It should skip a replica that is down until it is checked again"""
+        down = True
+
+        def connect():
+            if down:
+                raise sqlite3.OperationalError("connection refused")
+            return sqlite3.connect(":memory:")
+        healthy = create_engine("sqlite://")
+        broken = create_engine("sqlite://", creator=connect, poolclass=StaticPool)
+        timer = FakeTimer()
+        replicas = ReplicaSet([broken, healthy], interval=10, timer=timer)
+        self.assertEqual([replicas.choose() for _ in range(3)], [healthy, healthy, healthy])
+        self.assertEqual([stats["healthy"] for stats in replicas.stats()], [False, True])
+
+        down = False
+        timer.now = 5
+        self.assertEqual([replicas.choose() for _ in range(2)], [healthy, healthy])
+        timer.now = 11
+        self.assertIn(broken, [replicas.choose() for _ in range(2)])
+
+    def test_no_healthy_replica(self):
+        """It should return None when every replica is down"""
+        def refuse():
+            raise sqlite3.OperationalError("connection refused")
+        replicas = ReplicaSet([create_engine("sqlite://", creator=refuse, poolclass=StaticPool)])
+        self.assertIsNone(replicas.choose())
+
+
+class TestReadRouting(TestCase):
+    """Test the routing session against a replica"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.replica = create_engine("sqlite:///" + os.path.join(self.tmp.name, "replica.db"))
+        db.metadata.create_all(self.replica, tables=[Product.__table__])
+        with self.replica.begin() as connection:
+            connection.execute(Product.__table__.insert(), {
+                "name": "replica", "description": "only on the replica", "price": 1,
+                "available": True, "category": Category.FOOD, "version": 1,
+            })
+        with app.app_context():
+            db.create_all()
+            db.session.query(Product).delete()
+            db.session.commit()
+        Product.cache.clear()
+        app.extensions["replicas"] = ReplicaSet([self.replica])
+        self.client = app.test_client()
+
+    def tearDown(self):
+        del app.extensions["replicas"]
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+            db.session.remove()
+        self.replica.dispose()
+        self.tmp.cleanup()
+
+    def test_reads_go_to_replica(self):
+        """It should read from the replica"""
+        with app.app_context():
+            self.assertEqual([product.name for product in Product.all()], ["replica"])
+            self.assertEqual(Product.find_by_category(Category.FOOD).count(), 1)
+
+    def test_read_your_writes(self):
+        """It should read from the primary once the session wrote"""
+        with app.app_context():
+            product = ProductFactory(name="primary")
+            product.create()
+            self.assertEqual(product.name, "primary")
+            self.assertEqual([product.name for product in Product.all()], ["primary"])
+        with app.app_context():
+            self.assertEqual([product.name for product in Product.all()], ["replica"])
+
+    def test_sticky_after_write(self):
+        """It should keep a client that wrote on the primary"""
+        response = self.client.get("/products")
+        self.assertEqual([product["name"] for product in response.get_json()], ["replica"])
+
+        product = ProductFactory(name="primary")
+        data = product.serialize()
+        data["category"] = product.category.name
+        response = self.client.post("/products", json=data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.get_json()["name"], "primary")
+        self.assertIn(STICKY_COOKIE, response.headers["Set-Cookie"])
+
+        response = self.client.get("/products")
+        self.assertEqual([product["name"] for product in response.get_json()], ["primary"])
+
+        self.client.delete_cookie("localhost", STICKY_COOKIE)
+        response = self.client.get("/products")
+        self.assertEqual([product["name"] for product in response.get_json()], ["replica"])
+
+    def test_cache_replica_reads_briefly(self):
+        """It should cache rows read from a replica only for as long as it may lag"""
+        cache = MagicMock(enabled=True)
+        cache.get.return_value = None
+        with patch.object(Product, "cache", cache), app.app_context():
+            self.assertEqual(Product.find(1).name, "replica")
+            self.assertEqual(cache.set.call_args.kwargs["ttl"], app.config["REPLICA_STICKY_SECONDS"])
+            product = ProductFactory(name="primary")
+            product.create()
+            Product.find(product.id)
+            self.assertIsNone(cache.set.call_args.kwargs["ttl"])
+
+    def test_pool_stats(self):
+        """It should list the replicas in the pool stats"""
+        response = self.client.get("/metrics/pool")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["replicas"][0]["healthy"], True)
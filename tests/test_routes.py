@@ -1,64 +1,284 @@
-from flask import request, jsonify, abort
+"""
+Test cases for the Product routes
+"""
+import json
+from unittest import TestCase
+from urllib.parse import urlsplit
 from service import app
-from service.models import Product
 from service.common import status
+from service.models import db, Product, ProductStats
 
-@app.route("/products", methods=["POST"])
-def create_products():
-    """Create a new Product"""
-    data = request.get_json()
-    product = Product()
-    product.deserialize(data)
-    product.create()
-    
-    return jsonify(product.serialize()), status.HTTP_201_CREATED
-
-@app.route("/products/<int:product_id>", methods=["GET"])
-def get_products(product_id):
-    """Get a single Product"""
-    product = Product.find(product_id)
-    if not product:
-        abort(status.HTTP_404_NOT_FOUND, f"Product with id '{product_id}' was not found.")
-    
-    return jsonify(product.serialize()), status.HTTP_200_OK
-
-@app.route("/products/<int:product_id>", methods=["PUT"])
-def update_products(product_id):
-    """Update a Product"""
-    product = Product.find(product_id)
-    if not product:
-        abort(status.HTTP_404_NOT_FOUND, f"Product with id '{product_id}' was not found.")
-    
-    data = request.get_json()
-    product.deserialize(data)
-    product.update()
-    
-    return jsonify(product.serialize()), status.HTTP_200_OK
-
-@app.route("/products/<int:product_id>", methods=["DELETE"])
-def delete_products(product_id):
-    """Delete a Product"""
-    product = Product.find(product_id)
-    if product:
-        product.delete()
-    
-    return "", status.HTTP_204_NO_CONTENT
-
-@app.route("/products", methods=["GET"])
-def list_products():
-    """List all products with optional filtering"""
-    name = request.args.get("name")
-    category = request.args.get("category")
-    available = request.args.get("available")
-    
-    if name:
-        products = Product.find_by_name(name)
-    elif category:
-        products = Product.find_by_category(category)
-    elif available:
-        available_bool = available.lower() == "true"
-        products = Product.find_by_availability(available_bool)
-    else:
-        products = Product.all()
-    
-    return jsonify([product.serialize() for product in products]), status.HTTP_200_OK
\ No newline at end of file
+BASE_URL = "/products"
+
+
+class TestProductRoutes(TestCase):
+    """Test the HTTP contracts of the Product routes"""
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+            db.session.query(Product).delete()
+            ProductStats.recompute(db.session.connection())
+            db.session.commit()
+        Product.cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+            db.session.remove()
+
+    def create(self, name, category="FOOD", price=10, available=True, description="A product"):
+        """Creates a Product through the API and returns it"""
+        body = {"name": name, "description": description, "price": price, "available": available, "category": category}
+        response = self.client.post(BASE_URL, json=body)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return response.get_json()
+
+    def names(self, response):
+        """Returns the names of the Products in a list response"""
+        return [product["name"] for product in response.get_json()]
+
+    ######################################################################
+    # Conditional requests
+    ######################################################################
+
+    def test_get_not_modified(self):
+        """It should answer If-None-Match and If-Modified-Since with 304"""
+        product = self.create("Hat")
+        response = self.client.get(f"{BASE_URL}/{product['id']}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.client.get(f"{BASE_URL}/{product['id']}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(f"{BASE_URL}/{product['id']}", headers={"If-None-Match": f"W/{etag}"})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(f"{BASE_URL}/{product['id']}", headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(f"{BASE_URL}/{product['id']}", headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_if_match(self):
+        """It should refuse an update whose If-Match is out of date with 412"""
+        product = self.create("Hat")
+        etag = self.client.get(f"{BASE_URL}/{product['id']}").headers["ETag"]
+        product["name"] = "Cap"
+
+        response = self.client.put(f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["name"], "Cap")
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        response = self.client.put(f"{BASE_URL}/{product['id']}", json=product, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.put(f"{BASE_URL}/0", json=product)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_not_modified(self):
+        """It should give full lists an ETag that changes when a Product is deleted"""
+        self.create("Hat")
+        product = self.create("Cap")
+        response = self.client.get(BASE_URL)
+        etag = response.headers["ETag"]
+        self.assertNotIn("Last-Modified", response.headers)
+
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.delete(f"{BASE_URL}/{product['id']}")
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.names(response), ["Hat"])
+
+        self.assertNotIn("ETag", self.client.get(f"{BASE_URL}?limit=1").headers)
+
+    ######################################################################
+    # Listing
+    ######################################################################
+
+    def test_list_pages(self):
+        """It should page through a list with the Link header"""
+        for name in ("A", "B", "C"):
+            self.create(name)
+        names = []
+        url = f"{BASE_URL}?limit=2&sort=-name"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names += self.names(response)
+            link = response.headers.get("Link")
+            url = None
+            if link:
+                self.assertTrue(link.endswith('>; rel="next"'))
+                url = urlsplit(link[1:link.index(">")])
+                url = f"{url.path}?{url.query}"
+        self.assertEqual(names, ["C", "B", "A"])
+
+        self.assertEqual(self.client.get(f"{BASE_URL}?limit=0").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f"{BASE_URL}?cursor=bad").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_stream(self):
+        """It should stream a list as NDJSON or as a JSON array"""
+        self.create("Hat")
+        self.create("Cap")
+        response = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual([line["name"] for line in lines], ["Hat", "Cap"])
+
+        response = self.client.get(f"{BASE_URL}?stream=true")
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertEqual(self.names(response), ["Hat", "Cap"])
+
+    def test_list_filters(self):
+        """It should combine the filters of a list"""
+        self.create("Red hat", category="CLOTHS", price=5)
+        self.create("Hat stand", category="HOUSEWARES", price=50, available=False)
+        self.create("Spoon", category="HOUSEWARES", price=2, description="Not a hat")
+
+        response = self.client.get(f"{BASE_URL}?category=housewares&available=false")
+        self.assertEqual(self.names(response), ["Hat stand"])
+        response = self.client.get(f"{BASE_URL}?min_price=3&max_price=10")
+        self.assertEqual(self.names(response), ["Red hat"])
+
+        self.assertEqual(self.client.get(f"{BASE_URL}?category=toys").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f"{BASE_URL}?min_price=x").status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_search(self):
+        """It should rank the text matches of ?q= with name matches first"""
+        self.create("Red hat", category="CLOTHS", price=5)
+        self.create("Hat stand", category="HOUSEWARES", price=50, available=False)
+        self.create("Spoon", category="HOUSEWARES", price=2, description="Not a hat")
+        self.create("Fork", category="HOUSEWARES", price=2)
+
+        response = self.client.get(f"{BASE_URL}?q=hat")
+        self.assertEqual(self.names(response)[0], "Hat stand")
+        self.assertEqual(set(self.names(response)), {"Red hat", "Hat stand", "Spoon"})
+        response = self.client.get(f"{BASE_URL}?q=hat&category=housewares")
+        self.assertEqual(set(self.names(response)), {"Hat stand", "Spoon"})
+
+    def test_fields(self):
+        """It should return only the ?fields= asked for"""
+        product = self.create("Hat", price=12)
+        response = self.client.get(f"{BASE_URL}?fields=name,price")
+        self.assertEqual(list(response.get_json()[0]), ["name", "price"])
+
+        response = self.client.get(f"{BASE_URL}/{product['id']}?fields=name")
+        self.assertEqual(response.get_json(), {"name": "Hat"})
+        etag = response.headers["ETag"]
+        self.assertNotEqual(etag, self.client.get(f"{BASE_URL}/{product['id']}").headers["ETag"])
+        response = self.client.get(f"{BASE_URL}/{product['id']}?fields=name", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.assertEqual(self.client.get(f"{BASE_URL}?fields=secret").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f"{BASE_URL}/0?fields=name").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_ids(self):
+        """It should look up ?ids= in the order asked and list the missing ones"""
+        first = self.create("Hat")
+        second = self.create("Cap")
+        response = self.client.get(f"{BASE_URL}?ids={second['id']},0,{first['id']},{second['id']}&fields=id,name")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {
+            "products": [{"id": second["id"], "name": "Cap"}, {"id": first["id"], "name": "Hat"}],
+            "missing": [0],
+        })
+
+        self.assertEqual(self.client.get(f"{BASE_URL}?ids=1,x").status_code, status.HTTP_400_BAD_REQUEST)
+        too_many = ",".join(str(product_id) for product_id in range(app.config["MAX_IDS"] + 1))
+        self.assertEqual(self.client.get(f"{BASE_URL}?ids={too_many}").status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    # Batches
+    ######################################################################
+
+    def test_batch_create(self):
+        """It should create the valid items of a batch and report the others with 207"""
+        items = [
+            {"name": "Hat", "description": "Red", "price": 10, "available": True, "category": "CLOTHS"},
+            {"name": "Cap", "price": "free", "category": "CLOTHS"},
+        ]
+        response = self.client.post(f"{BASE_URL}/batch", json=items)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.get_json()
+        self.assertEqual([result["status"] for result in results], [201, 400])
+        self.assertEqual(results[0]["product"]["name"], "Hat")
+        self.assertIn("error", results[1])
+
+        body = "\n".join(json.dumps(item) for item in items[:1] * 2)
+        response = self.client.post(f"{BASE_URL}/batch", data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.names(self.client.get(BASE_URL)), ["Hat"] * 3)
+
+        response = self.client.post(f"{BASE_URL}/batch", json={"name": "Hat"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_create_wrong_types(self):
+        """It should report batch items with a value of the wrong type instead of failing the batch"""
+        items = [
+            {"name": "Hat", "price": 10, "available": "yes", "category": "CLOTHS"},
+            {"name": "Cap", "price": 5, "available": False, "category": "CLOTHS"},
+        ]
+        response = self.client.post(f"{BASE_URL}/batch", json=items)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.get_json()
+        self.assertEqual([result["status"] for result in results], [400, 201])
+        self.assertIn("available", results[0]["error"])
+        self.assertEqual(self.names(self.client.get(BASE_URL)), ["Cap"])
+
+        product = dict(items[0], available=1)
+        self.assertEqual(self.client.post(BASE_URL, json=product).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_update(self):
+        """It should update every Product matching the filter"""
+        self.create("Hat", category="CLOTHS")
+        self.create("Cap", category="CLOTHS")
+        self.create("Spoon", category="HOUSEWARES")
+        body = {"filter": {"category": "CLOTHS"}, "set": {"available": False, "price": 3}}
+        response = self.client.patch(f"{BASE_URL}/batch", json=body)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"updated": 2})
+        self.assertEqual(self.names(self.client.get(f"{BASE_URL}?available=false")), ["Hat", "Cap"])
+
+        body = {"filter": {"category": "CLOTHS"}, "set": {"available": "no"}}
+        self.assertEqual(self.client.patch(f"{BASE_URL}/batch", json=body).status_code, status.HTTP_400_BAD_REQUEST)
+        body = {"filter": {}, "set": {"price": 1}}
+        self.assertEqual(self.client.patch(f"{BASE_URL}/batch", json=body).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_delete(self):
+        """It should delete the Products matching the query or the ids in the body"""
+        hat = self.create("Hat", category="CLOTHS")
+        self.create("Cap", category="CLOTHS")
+        spoon = self.create("Spoon", category="HOUSEWARES")
+        response = self.client.delete(BASE_URL, json={"ids": [hat["id"], spoon["id"], 0]})
+        self.assertEqual(response.get_json(), {"deleted": 2})
+        response = self.client.delete(f"{BASE_URL}?category=cloths")
+        self.assertEqual(response.get_json(), {"deleted": 1})
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+
+        self.assertEqual(self.client.delete(BASE_URL).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.delete(f"{BASE_URL}?color=red").status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    # Stats
+    ######################################################################
+
+    def test_stats(self):
+        """It should keep the stats of each category in step with writes"""
+        self.create("Hat", category="CLOTHS", price=10, available=True)
+        cap = self.create("Cap", category="CLOTHS", price=30, available=False)
+        self.create("Spoon", category="HOUSEWARES", price=2)
+        self.client.delete(f"{BASE_URL}/{cap['id']}")
+        self.create("Scarf", category="CLOTHS", price=20, available=False)
+
+        response = self.client.get(f"{BASE_URL}/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = {row["category"]: row for row in response.get_json()}
+        cloths = stats["CLOTHS"]
+        self.assertEqual((cloths["count"], cloths["available"], cloths["availability_ratio"]), (2, 1, 0.5))
+        self.assertEqual([float(cloths[key]) for key in ("min_price", "avg_price", "max_price")], [10, 15, 20])
+        self.assertEqual(stats["HOUSEWARES"]["count"], 1)
+        self.assertEqual(stats["FOOD"]["count"], 0)
+        self.assertIsNone(stats["FOOD"]["avg_price"])
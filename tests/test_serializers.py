@@ -0,0 +1,78 @@
+"""
+Test cases for the Product Serializers
+"""
+from unittest.mock import patch
+import pytest
+from flask import jsonify
+from service import serializers
+from service.models import Product, db, DataValidationError
+from tests.factories import ProductFactory
+
+
+@pytest.fixture(scope="module")
+def app():
+    """Setup the test app"""
+    from service import app
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture(scope="function")
+def database(app):
+    """Clean the database between tests"""
+    db.session.query(Product).delete()
+    db.session.commit()
+
+
+class TestSerializers:
+    """Test suite for the column-only serializers"""
+
+    def expected(self, app):
+        """Returns what jsonify makes of the serialized Products"""
+        products = Product.query.order_by(Product.id).all()
+        return jsonify([product.serialize() for product in products]).get_data()
+
+    def actual(self):
+        """Returns what the fast path makes of the same Products"""
+        rows = serializers.project(Product.query.order_by(Product.id))
+        return serializers.dumps([serializers.serialize_row(row) for row in rows]) + b"\n"
+
+    def test_same_bytes_as_jsonify(self, app, database):
+        """It should produce exactly the bytes of jsonify"""
+        for product in ProductFactory.create_batch(5):
+            product.create()
+        ProductFactory(name="Café crème", description=None).create()
+        db.session.expire_all()
+
+        assert self.actual() == self.expected(app)
+
+    def test_same_bytes_without_orjson(self, app, database):
+        """It should fall back to the json module when orjson is missing"""
+        for product in ProductFactory.create_batch(3):
+            product.create()
+        db.session.expire_all()
+
+        with patch.object(serializers, "orjson", None):
+            assert self.actual() == self.expected(app)
+
+    def test_sparse_fields(self, app, database):
+        """It should read and return only the requested fields"""
+        product = ProductFactory()
+        product.create()
+
+        fields = serializers.parse_fields("price, id,price")
+        assert fields == ("price", "id")
+        query = serializers.project(Product.query, fields, ("version",))
+        assert [column["name"] for column in query.column_descriptions] == ["price", "id", "version"]
+        assert serializers.serialize_row(query.one(), fields) == {"price": product.price, "id": product.id}
+
+    def test_invalid_fields(self, app, database):
+        """It should reject unknown fields"""
+        with pytest.raises(DataValidationError):
+            serializers.parse_fields("id,weight")
+        with pytest.raises(DataValidationError):
+            serializers.parse_fields(",")
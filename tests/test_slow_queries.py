@@ -0,0 +1,125 @@
+"""
+Test cases for the slow query log
+"""
+import json
+import os
+import tempfile
+from unittest import TestCase
+from service import app
+from service.common import slow_queries
+from service.common.slow_queries import SlowQueryLog, normalize, aggregate
+from service.models import db, Product, Category
+from tests.factories import ProductFactory
+
+
+class TestNormalize(TestCase):
+    """Test statement shapes"""
+
+    def test_parameters(self):
+        """It should replace parameters and literals"""
+        self.assertEqual(
+            normalize("SELECT *\n  FROM product WHERE id = %(id_1)s AND name = 'Hat' LIMIT 10"),
+            "SELECT * FROM product WHERE id = ? AND name = ? LIMIT ?",
+        )
+        self.assertEqual(normalize("SELECT x::text FROM t WHERE a = :a_1"), "SELECT x::text FROM t WHERE a = ?")
+
+    def test_lists(self):
+        """It should collapse IN lists and multi-row VALUES"""
+        self.assertEqual(
+            normalize("SELECT * FROM product WHERE id IN (?, ?, ?)"),
+            normalize("SELECT * FROM product WHERE id IN (?)"),
+        )
+        self.assertEqual(
+            normalize("INSERT INTO product (a, b) VALUES (%s, %s), (%s, %s)"),
+            "INSERT INTO product (a, b) VALUES (...)",
+        )
+
+    def test_aggregate(self):
+        """It should sum up records by shape"""
+        shapes = aggregate([
+            {"shape": "A", "ms": 10, "route": "GET /products"},
+            {"shape": "B", "ms": 50, "route": None},
+            {"shape": "A", "ms": 30, "route": "GET /products/<int:product_id>"},
+        ])
+        self.assertEqual([shape["shape"] for shape in shapes], ["B", "A"])
+        self.assertEqual(shapes[1]["count"], 2)
+        self.assertEqual(shapes[1]["mean_ms"], 20)
+        self.assertEqual(shapes[1]["max_ms"], 30)
+        self.assertEqual(shapes[1]["routes"], ["GET /products", "GET /products/<int:product_id>"])
+        self.assertEqual(shapes[0]["routes"], ["-"])
+
+
+class TestSlowQueryLog(TestCase):
+    """Test recording slow statements"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "slow.ndjson")
+        with app.app_context():
+            db.create_all()
+            db.session.query(Product).delete()
+            ProductFactory(category=Category.FOOD).create()
+            db.session.remove()
+        self.log = None
+
+    def tearDown(self):
+        if self.log:
+            self.log.remove()
+        with app.app_context():
+            db.session.query(Product).delete()
+            db.session.commit()
+            db.session.remove()
+        self.tmp.cleanup()
+
+    def records(self):
+        """Returns the records written so far"""
+        if not os.path.exists(self.path):
+            return []
+        return list(slow_queries.read_log(self.path))
+
+    def test_threshold(self):
+        """It should skip statements faster than the threshold"""
+        self.log = SlowQueryLog(60000, path=self.path)
+        self.log.listen()
+        app.test_client().get("/products")
+        self.assertEqual(self.records(), [])
+
+    def test_record(self):
+        """It should record slow statements with their route, parameters and plan"""
+        self.log = SlowQueryLog(0, explain=True, path=self.path)
+        self.log.listen()
+        with self.assertLogs("flask.app", "WARNING") as logs:
+            response = app.test_client().get("/products?category=FOOD")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 1)
+        self.assertTrue(any("Slow query" in line for line in logs.output))
+        records = self.records()
+        self.assertTrue(records)
+        self.assertEqual({record["route"] for record in records}, {"GET /products"})
+        listing = [record for record in records if "product.category = " in record["statement"]]
+        self.assertTrue(listing)
+        self.assertIn("FOOD", listing[0]["parameters"])
+        self.assertIn("product.category = ?", listing[0]["shape"])
+        self.assertTrue(all(record.get("plan") for record in listing), listing)
+        self.assertGreaterEqual(listing[0]["ms"], 0)
+
+    def test_outside_request(self):
+        """It should record statements run outside of a request without a route"""
+        self.log = SlowQueryLog(0, path=self.path)
+        self.log.listen()
+        with app.app_context():
+            Product.find_by_category(Category.FOOD).all()
+        self.assertTrue(self.records())
+        self.assertIsNone(self.records()[0]["route"])
+        self.assertNotIn("plan", self.records()[0])
+
+    def test_report(self):
+        """It should sum the log up by shape with flask slow-queries"""
+        with open(self.path, "w", encoding="utf-8") as output:
+            for ms in (10, 30):
+                output.write(json.dumps({"shape": "SELECT ?", "ms": ms, "route": "GET /products"}) + "\n")
+            output.write("not json\n")
+        result = app.test_cli_runner().invoke(args=["slow-queries", self.path, "--sort", "max"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertRegex(result.output, r"\s2\s+40.0\s+20.0\s+30.0\s+SELECT \?")
+        self.assertIn("from GET /products", result.output)